@@ -1,20 +1,52 @@
 # cd ../keras && bash run.sh std.cpp.test_table &
-from std import Object, compile_cpp, delete_indices
+from std import compile_cpp
 from std.debug import default_on_error
 compile_cpp(__file__, 'rabin_karp')
 
-from std.cpp.rabin_karp import repetition_penalty as cpp_repetition_penalty
+from std.cpp.rabin_karp import repetition_penalty as cpp_repetition_penalty, repetition_penalty_array as cpp_repetition_penalty_array, repetition_penalty_batch as cpp_repetition_penalty_batch
 from std.parser.markdown import MarkdownParser
 
-def repetition_penalty_with_markdown_tags(answer):
-    info = cpp_repetition_penalty(answer)
-    tree = MarkdownParser.instance.build(answer)
+def repetition_penalty_with_markdown_tags(answer, tree=None, info=None):
+    # info is cpp_repetition_penalty(answer) if already detected
+    if info is None:
+        info = cpp_repetition_penalty(answer)
+    if tree is None:
+        tree = MarkdownParser.instance.build(answer)
+    # answer the span queries of all repetitions in one batch
+    span_index = tree.span_index
+    nodes = span_index.nodes
+    spans = iter(span_index.span(
+        [start_idx for res in info for start_idx in res['index']],
+        [start_idx + len(res['text']) for res in info for start_idx in res['index']]
+    ).tolist())
     for res in info:
-        length = len(res['text'])
-        index = res['index']
-        res['tagName'] = [span.parent.func if (span := tree.span(Object(start_idx=start_idx, end_idx=start_idx + length))) else None for start_idx in index]
+        res['tagName'] = [nodes[span].parent.func if (span := next(spans)) >= 0 else None for _ in res['index']]
     return info
 
+def repetition_clusters(occurrences, min_repetition_count, min_scan_length, max_distance_multiple, min_coverage_area):
+    '''
+    the clustering of repetition_penalty over occurrences, a structured array of cpp_repetition_penalty_array, vectorized over all the occurrences at once:
+    the occurrences of a pattern are split into clusters wherever two consecutive ones are more than max_distance apart,
+    and a cluster of at least repetition_count occurrences scores the utf8-bytes it covers.
+    returns the total score, and the ids of the patterns with such a cluster.
+    '''
+    import numpy as np
+    match = occurrences['match']
+    index = occurrences['index'].astype(np.int64)
+    scan_length = occurrences['scan_length'].astype(np.int64)
+    if not len(match):
+        return 0, match
+    repetition_count = np.where(scan_length < min_scan_length, (min_coverage_area / scan_length).astype(np.int64), min_repetition_count)
+    max_distance = (max_distance_multiple + 1) * scan_length
+
+    # the first occurrence of each cluster
+    start = np.ones(len(match), dtype=bool)
+    start[1:] = (match[1:] != match[:-1]) | (index[1:] - index[:-1] > max_distance[1:])
+    start = np.flatnonzero(start)
+    size = np.diff(np.append(start, len(match)))
+    hit = size >= repetition_count[start]
+    return int((scan_length[start] * size)[hit].sum()), np.unique(match[start[hit]])
+
 @default_on_error({'score' : -30})
 def repetition_penalty(
     prompt, 
@@ -45,42 +77,37 @@ def repetition_penalty(
         # html tags: <code></code>
         # 'MarkdownCODE',
     ),
+    tree=None,
+    info=None,
     **_
 ):
     # add prompt logic if necessary?
-    score = 0
-    error = repetition_penalty_with_markdown_tags(answer)
-    indicesToDelete = set()
-    for error_i, res in enumerate(error):
-        text = res['text']
-        # remove markdown syntax
-        # if not re.sub(r'[\s*-:|]+', '', error):
-            # continue
-        index = []
-        names = []
-        for i, tagName in zip(res['index'], res['tagName']):
-            if tagName in ignores:
-                continue
-            index.append(i)
-            names.append(tagName)
-            assert answer[i:i+ len(text)] == text
-        hit = False
-        scan_length = res['scan_length']
-        # scan_length is the utf8-bytes of the text returned from C++, it must be equal to length of bytes representation of the text
-        assert scan_length == len(text.encode())
-        repetition_count = int(min_coverage_area / scan_length) if scan_length < min_scan_length else min_repetition_count
-        max_distance = (max_distance_multiple + 1) * scan_length
-        start = 0
-        for i in range(len(index)):
-            stop = i + 1
-            if stop >= len(index) or index[stop] - index[i] > max_distance:
-                if (size := stop - start) >= repetition_count:
-                    hit = True
-                    score += scan_length * size # use the total utf8-bytes it covers as the score
-                start = stop
-        if not hit:
-            indicesToDelete.add(error_i)
-    error = delete_indices(error, indicesToDelete)
+    import numpy as np
+    # info is cpp_repetition_penalty_array(answer) if already detected: one row per occurrence of a pattern, whose text is answer[index:index + length]
+    if info is None:
+        info = cpp_repetition_penalty_array(answer)
+    if tree is None:
+        tree = MarkdownParser.instance.build(answer)
+    # answer the span queries of all occurrences in one batch, and look up the tag of each distinct node once
+    span_index = tree.span_index
+    nodes = span_index.nodes
+    spans, inverse = np.unique(span_index.span(info['index'], info['index'] + info['length']), return_inverse=True)
+    tagNames = [nodes[span].parent.func if span >= 0 else None for span in spans.tolist()]
+    ignored = np.array([tagName in ignores for tagName in tagNames], dtype=bool)[inverse]
+    tagNames = np.array(tagNames, dtype=object)
+
+    score, hits = repetition_clusters(info[~ignored], min_repetition_count, min_scan_length, max_distance_multiple, min_coverage_area)
+    # the text, indices and tags of the patterns hit, as cpp_repetition_penalty and repetition_penalty_with_markdown_tags give them
+    error = []
+    bounds = np.searchsorted(info['match'], np.stack([hits, hits + 1]))
+    for start, stop in bounds.T.tolist():
+        index = info['index'][start:stop].tolist()
+        error.append({
+            'text': answer[index[0]:index[0] + int(info['length'][start])],
+            'index': index,
+            'scan_length': int(info['scan_length'][start]),
+            'tagName': tagNames[inverse[start:stop]].tolist(),
+        })
     return {
         'score': -score / min_scan_length,
         'error': error,
@@ -91,6 +118,110 @@ def repetition_penalty(
         'ignores': ignores,
     }
 
+def repetition_penalty_batch(prompts, answers, threads=0, **kwargs):
+    '''
+    repetition_penalty of each answer, with the repetitions of all answers detected at once by cpp_repetition_penalty_batch,
+    which runs them on threads native threads (all the cores if threads <= 0) with the GIL released.
+    an answer whose detection failed, or which could not be encoded into utf-8, is scored by repetition_penalty on its own, so that it fails the same way.
+    '''
+    infos = cpp_repetition_penalty_batch(answers, threads, array=True)
+    return [repetition_penalty(prompt, answer, info=info, **kwargs) for prompt, answer, info in zip(prompts, answers, infos)]
+
+def test_batch(folder='std/src/hash/test/', repeat=8):
+    '''
+    check that cpp_repetition_penalty_batch returns the same as cpp_repetition_penalty on the files under folder, repeated repeat times,
+    and on a batch mixing them with a text that cannot be encoded, and print the time spent one by one, by a thread pool of python threads calling cpp_repetition_penalty, and by cpp_repetition_penalty_batch.
+    '''
+    import io, os, time, contextlib
+    from concurrent.futures import ThreadPoolExecutor
+    from std import listdir
+
+    answers = []
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            answers.append(f.read())
+    answers *= repeat
+
+    start = time.perf_counter()
+    expected = [cpp_repetition_penalty(answer) for answer in answers]
+    serial = time.perf_counter() - start
+
+    with ThreadPoolExecutor(os.cpu_count()) as executor:
+        start = time.perf_counter()
+        [*executor.map(cpp_repetition_penalty, answers)]
+        threaded = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = cpp_repetition_penalty_batch(answers)
+    batch = time.perf_counter() - start
+    assert results == expected, 'results of cpp_repetition_penalty_batch differ from those of cpp_repetition_penalty'
+
+    # a text holding a lone surrogate cannot be encoded into utf-8: it fails alone, and repetition_penalty_batch scores it as repetition_penalty does
+    mixed = [answers[0], 'a\ud800b', answers[1]]
+    assert cpp_repetition_penalty_batch(mixed) == [expected[0], None, expected[1]], 'a text that cannot be encoded fails the batch'
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        scores = repetition_penalty_batch([None] * len(mixed), mixed)
+        assert scores[1] == repetition_penalty(None, mixed[1]) == {'score': -30}, 'a text that cannot be encoded is not scored on its own'
+    assert scores[0] == repetition_penalty(None, mixed[0]) and scores[2] == repetition_penalty(None, mixed[2]), 'the other texts of a mixed batch are scored differently'
+
+    print(f'{len(answers)} answers on {os.cpu_count()} cores: one by one in {serial:.3f}s, by python threads in {threaded:.3f}s, by cpp_repetition_penalty_batch in {batch:.3f}s')
+
+def test_array(folder='std/src/hash/test/', repeat=4):
+    '''
+    check that cpp_repetition_penalty_array holds the same occurrences as cpp_repetition_penalty on the files under folder, repeated repeat times,
+    and that repetition_clusters scores them as the loop over the lists does; print the time spent by each way.
+    '''
+    import time
+    from std import listdir
+
+    def clusters(info, min_repetition_count, min_scan_length, max_distance_multiple, min_coverage_area):
+        # the loop repetition_penalty ran over the lists of cpp_repetition_penalty
+        score = 0
+        hits = []
+        for match, res in enumerate(info):
+            index = res['index']
+            scan_length = res['scan_length']
+            repetition_count = int(min_coverage_area / scan_length) if scan_length < min_scan_length else min_repetition_count
+            max_distance = (max_distance_multiple + 1) * scan_length
+            start = 0
+            hit = False
+            for i in range(len(index)):
+                stop = i + 1
+                if stop >= len(index) or index[stop] - index[i] > max_distance:
+                    if (size := stop - start) >= repetition_count:
+                        hit = True
+                        score += scan_length * size
+                    start = stop
+            if hit:
+                hits.append(match)
+        return score, hits
+
+    answers = []
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            answers.append(f.read())
+    answers *= repeat
+
+    kwargs = {'min_repetition_count': 3, 'min_scan_length': 64, 'max_distance_multiple': 14, 'min_coverage_area': 428}
+    cost = [0, 0]
+    for answer in answers:
+        start = time.perf_counter()
+        info = cpp_repetition_penalty(answer)
+        expected = clusters(info, **kwargs)
+        cost[0] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        array = cpp_repetition_penalty_array(answer)
+        score, hits = repetition_clusters(array, **kwargs)
+        cost[1] += time.perf_counter() - start
+
+        assert (score, hits.tolist()) == expected, 'repetition_clusters differs from the loop over the lists'
+        assert array['match'].tolist() == [match for match, res in enumerate(info) for _ in res['index']], 'occurrences differ'
+        assert array['index'].tolist() == [index for res in info for index in res['index']], 'indices differ'
+        assert [answer[index:index + length] for index, length in zip(array['index'].tolist(), array['length'].tolist())] == [res['text'] for res in info for _ in res['index']], 'texts differ'
+
+    print(f'{len(answers)} answers: lists and loop in {cost[0]:.3f}s, arrays and repetition_clusters in {cost[1]:.3f}s')
+
 def test_table(id=None, Rank=None, offset=0):
     import json
     from std import MySQL
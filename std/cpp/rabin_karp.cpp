@@ -1,5 +1,8 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <pybind11/numpy.h>
+#include <atomic>
+#include <thread>
 #include "../src/hash/RabinKarp.h"
 namespace py = pybind11;
 using namespace std;
@@ -25,12 +28,17 @@ std::string strip_malformed_utf8(const std::string &s, int &start, int &stop)
 	return s.substr(start, max(stop - start, 0));
 }
 
-py::list repetition_penalty(py::str py_str)
+struct Repetition
 {
-    // Convert Python str to UTF-8 encoded string
-    string text = py_str.cast<string>();
-    // Detect redundant patterns in the text
-    py::list list;
+    string text;
+    vector<int> index;
+    int scan_length;
+};
+
+// detect the redundant patterns in text, without touching any python object, so that it can run with the GIL released
+vector<Repetition> detect_repetitions(const string &text)
+{
+    vector<Repetition> repetitions;
     RabinKarp parser(text);
     parser.init_physicOffset();
     for (auto &[scan_length, hashCode, indices] : parser.redundancy_detect())
@@ -43,17 +51,126 @@ py::list repetition_penalty(py::str py_str)
             for (int &index : indices)
                 index += offset;
         }
+        repetitions.push_back({error, parser.physic2logic(indices), stop - start});
+    }
+    return repetitions;
+}
+
+py::list to_list(const vector<Repetition> &repetitions)
+{
+    py::list list;
+    for (auto &[text, index, scan_length] : repetitions)
+    {
         py::dict obj;
-        obj["text"] = error;
-        obj["index"] = parser.physic2logic(indices);
-        obj["scan_length"] = stop - start;
+        obj["text"] = text;
+        obj["index"] = index;
+        obj["scan_length"] = scan_length;
         list.append(obj);
     }
     return list;
 }
 
+// an occurrence of a redundant pattern: the id of its pattern, its start in characters, and the length of the pattern in characters and in utf-8 bytes
+struct Occurrence
+{
+    int match;
+    int index;
+    int length;
+    int scan_length;
+};
+
+// the occurrences of all patterns as a structured numpy array, grouped by pattern in the order of repetition_penalty,
+// so that answer[index:index + length] is the text of the pattern
+py::array_t<Occurrence> to_array(const vector<Repetition> &repetitions)
+{
+    vector<Occurrence> occurrences;
+    int match = 0;
+    for (auto &[text, index, scan_length] : repetitions)
+    {
+        int length = 0;
+        for (unsigned char byte : text)
+            length += (byte & 0xC0) != 0x80;
+        for (int start : index)
+            occurrences.push_back({match, start, length, scan_length});
+        ++match;
+    }
+    py::array_t<Occurrence> array(occurrences.size());
+    std::copy(occurrences.begin(), occurrences.end(), array.mutable_data());
+    return array;
+}
+
+py::list repetition_penalty(py::str py_str)
+{
+    // Convert Python str to UTF-8 encoded string
+    string text = py_str.cast<string>();
+    // Detect redundant patterns in the text
+    return to_list(detect_repetitions(text));
+}
+
+py::array_t<Occurrence> repetition_penalty_array(py::str py_str)
+{
+    string text = py_str.cast<string>();
+    return to_array(detect_repetitions(text));
+}
+
+// repetition_penalty (or repetition_penalty_array if array is set) of each text, computed by a pool of threads (all the cores if threads <= 0) with the GIL released, in the order of texts;
+// a text that cannot be encoded into utf-8 (such as a str holding a lone surrogate), or whose detection throws, is returned as None
+py::list repetition_penalty_batch(const py::list &py_texts, int threads, bool array)
+{
+    int size = py_texts.size();
+    vector<string> texts(size);
+    vector<vector<Repetition>> results(size);
+    vector<char> failed(size);
+    // the texts are encoded one by one with the GIL held, so that a text failing to convert fails alone instead of the whole batch
+    for (int i = 0; i < size; ++i) {
+        try {
+            texts[i] = py_texts[i].cast<string>();
+        }
+        catch (const py::cast_error &) {
+            failed[i] = true;
+        }
+        catch (const py::error_already_set &) {
+            failed[i] = true;
+        }
+    }
+    {
+        py::gil_scoped_release release;
+        if (threads <= 0)
+            threads = std::max(1u, std::thread::hardware_concurrency());
+        threads = std::min(threads, size);
+        // each thread takes the next text not yet taken, so that long texts do not hold up a thread's share of the others
+        std::atomic<int> next = 0;
+        auto work = [&]() {
+            for (int i; (i = next++) < size;) {
+                if (failed[i])
+                    continue;
+                try {
+                    results[i] = detect_repetitions(texts[i]);
+                }
+                catch (...) {
+                    failed[i] = true;
+                }
+            }
+        };
+        vector<std::thread> pool;
+        for (int i = 1; i < threads; ++i)
+            pool.emplace_back(work);
+        work();
+        for (auto &thread : pool)
+            thread.join();
+    }
+
+    py::list list;
+    for (int i = 0; i < size; ++i)
+        list.append(failed[i]? py::object(py::none()) : array? py::object(to_array(results[i])) : py::object(to_list(results[i])));
+    return list;
+}
+
 // Binding the function to Python
 PYBIND11_MODULE(rabin_karp, m)
 {
+    PYBIND11_NUMPY_DTYPE(Occurrence, match, index, length, scan_length);
     m.def("repetition_penalty", &repetition_penalty);
-}
\ No newline at end of file
+    m.def("repetition_penalty_array", &repetition_penalty_array);
+    m.def("repetition_penalty_batch", &repetition_penalty_batch, py::arg("texts"), py::arg("threads") = 0, py::arg("array") = false);
+}
@@ -15,7 +15,21 @@
 # https://markdownlivepreview.com/
 # https://www.bejson.com/md/
 
-@__set__(Tag)
+class Block:
+    '''
+    an html element of the markdown as md.render renders it, built from the token stream of md.parse: only the nesting of the block elements is kept,
+    since inline elements are never headings, lists or tables, and so never change the depth of the element they are in.
+    '''
+    __slots__ = ('name', 'children', 'text', 'depth')
+
+    def __init__(self, name):
+        self.name = name
+        self.children = []
+        # the text of the element, only kept for headings
+        self.text = ''
+
+
+@__set__(Tag, Block)
 @property
 def has_heading_elements(self):
     return any(
@@ -30,7 +44,7 @@ def answer_depth(self):
     return self.depth
 
 
-@__set__(Tag)
+@__set__(Tag, Block)
 @property
 def answer_depth(self):
     [*children] = self.children
@@ -44,7 +58,7 @@ def set_answer_depth(self, depth):
     self.depth = depth
 
 
-@__set__(Tag)
+@__set__(Tag, Block)
 def set_answer_depth(self, depth):
     self.depth = depth
     [*children] = self.children
@@ -83,20 +97,74 @@ def set_answer_depth(self, depth):
             child.set_answer_depth(depth_list if is_list(child) else depth)
 
 
+def preprocess_markdown(markdown):
+    markdown = markdown.replace('\n- ', '\n   - ')
+    markdown = re.sub(r'(?<=[:：]|\*\*)\n+(?=[a-zA-Z\p{Han}])', ' ', markdown)
+    markdown = re.sub(r'\*\*(\d+\. )([^*]+)\*\*', r'\1**\2**', markdown)
+    markdown = re.sub(r'(?<=\n)\((\d+)\) ', r'   \1. ', markdown)
+    markdown = re.sub(r'(?<=\n |\n  )(\d+)\. ', r'   \1. ', markdown)
+    return markdown
+
+
 def md2html(markdown, preprocess=True):
     if preprocess:
-        markdown = markdown.replace('\n- ', '\n   - ')
-        markdown = re.sub(r'(?<=[:：]|\*\*)\n+(?=[a-zA-Z\p{Han}])', ' ', markdown)
-        markdown = re.sub(r'\*\*(\d+\. )([^*]+)\*\*', r'\1**\2**', markdown)
-        markdown = re.sub(r'(?<=\n)\((\d+)\) ', r'   \1. ', markdown)
-        markdown = re.sub(r'(?<=\n |\n  )(\d+)\. ', r'   \1. ', markdown)
+        markdown = preprocess_markdown(markdown)
     html = md.render(markdown)
     return BeautifulSoup(html, 'html.parser')
 
 
-def answer_depth(answer, max=6):
+def tokens2block(tokens):
+    '''
+    the tree of Block that BeautifulSoup would parse out of the html rendered from tokens, the token stream of md.parse, without rendering html.
+    returns None if tokens hold raw html, whose tags only BeautifulSoup can tell.
+    '''
+    root = Block('[document]')
+    stack = [root]
+    for token in tokens:
+        if token.hidden:
+            # the paragraphs of tight lists, whose inline content is rendered right into the li
+            continue
+        if token.nesting > 0:
+            block = Block(token.tag)
+            stack[-1].children.append(block)
+            stack.append(block)
+        elif token.nesting < 0:
+            stack.pop()
+        elif token.type == 'inline':
+            text = []
+            for child in token.children:
+                if child.type in ('text', 'code_inline'):
+                    text.append(child.content)
+                elif child.type in ('softbreak', 'hardbreak'):
+                    text.append('\n')
+                elif child.type == 'html_inline':
+                    return None
+            stack[-1].text = ''.join(text)
+        elif token.type == 'html_block':
+            return None
+        else:
+            # fence, code_block and hr, which render as elements without block elements in them
+            stack[-1].children.append(Block(token.tag))
+    return root
+
+
+def md2tree(markdown, tokens=False):
+    '''
+    the root of the elements of markdown, preprocessed: a BeautifulSoup of the html rendered from it,
+    or with tokens=True, a Block built from the token stream of markdown-it, unless it holds raw html, when the html is rendered from the tokens already parsed.
+    '''
+    if not tokens:
+        return md2html(markdown)
+    tokens = md.parse(preprocess_markdown(markdown))
+    return tokens2block(tokens) or BeautifulSoup(md.renderer.render(tokens, md.options, {}), 'html.parser')
+
+
+def answer_depth(answer, max=6, tokens=False):
+    '''
+    with tokens=True, the depth is computed from the token stream of markdown-it, instead of the html rendered from it and parsed again by BeautifulSoup.
+    '''
     result = {}
-    html = md2html(answer)
+    html = md2tree(answer, tokens)
     html.set_answer_depth(1)
     depth = html.answer_depth
     if depth > 6:
@@ -107,8 +175,8 @@ def answer_depth(answer, max=6):
     return result
 
 
-def _answer_breadth(answer):
-    html = md2html(answer)
+def _answer_breadth(answer, tokens=False):
+    html = md2tree(answer, tokens)
     html.set_answer_depth(1)
     children = [*html.children]
     ol = []
@@ -160,9 +228,12 @@ def _answer_breadth(answer):
     return level + len(ol) + len(ul)
 
 
-def answer_breadth(answer, max=30):
+def answer_breadth(answer, max=30, tokens=False):
+    '''
+    with tokens=True, the breadth is computed from the token stream of markdown-it, instead of the html rendered from it and parsed again by BeautifulSoup.
+    '''
     result = {}
-    breadth = _answer_breadth(answer)
+    breadth = _answer_breadth(answer, tokens)
     if breadth > max:
         result['error'] = f'breadth = {breadth} exceeds {max}'
         breadth = -1
@@ -170,6 +241,31 @@ def answer_breadth(answer, max=30):
     result['score'] = breadth
     return result
 
+def test_tokens(folder='std/src/hash/test/'):
+    '''
+    check that answer_depth and answer_breadth give the same results from the token stream as from the html on the files under folder,
+    and print the time spent by each path.
+    '''
+    import time
+    from std import listdir
+
+    answers = []
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            answers.append(f.read())
+
+    cost = [0, 0]
+    for answer in answers:
+        results = []
+        for i, tokens in enumerate((False, True)):
+            start = time.perf_counter()
+            results.append((answer_depth(answer, tokens=tokens), answer_breadth(answer, tokens=tokens)))
+            cost[i] += time.perf_counter() - start
+        assert results[0] == results[1], f'{answer[:64]!r}: the results from the tokens differ from those from the html'
+
+    print(f'{len(answers)} answers: depth and breadth from the html in {cost[0]:.3f}s, from the tokens in {cost[1]:.3f}s, speedup {cost[0] / cost[1]:.2f}x')
+
+
 def test_table(id=None, Rank=None, offset=0):
     import json
     from std import MySQL
@@ -1,9 +1,11 @@
 # cd ../keras && bash run.sh std.nlp.lang.test_batch &
+import functools, threading, collections
 import regex as re
-from std.nlp.segment import sbd
+from std.nlp.segment import sbd, sbd_spans
 from std.parser.markdown import *
 from std.debug import default_on_error
 from std import __set__
+from std.unicode import utf8_lengths
 
 Han = re.compile(r'\p{Han}')
 Han2 = re.compile(r'\p{Han}{2,}')
@@ -65,40 +67,7 @@ def detect_language(text, fast=True):
     if Han2.match(text):
         return 'cn'
 
-    cn = 0
-    en = 0
-
-    mid = len(text) / 2
-    for i, ch in enumerate(text):
-        position_weight = (i - mid + 0.01) / mid
-        position_weight = position_weight ** 2
-        if re.compile(r'\p{Letter}').match(ch):
-            if Han.match(ch):
-                cn += 8 * position_weight
-            else:
-                en += position_weight
-
-        elif re.compile(r'\p{Number}').match(ch):
-            if ord(ch) > 256:
-                cn += 2 * position_weight
-            else:
-                en += position_weight
-
-        elif re.compile(r'\p{Punctuation}').match(ch):
-            if ord(ch) > 256:
-                cn += 2 * position_weight
-            else:
-                en += position_weight
-
-        elif re.compile(r'\p{Symbol}').match(ch):
-            ...
-        elif re.compile(r'\p{Separator}').match(ch):
-            ...
-        elif re.compile(r'\p{Mark}').match(ch):
-            ...
-        else:
-            ...
-            
+    cn, en = weighted_scores(text)
     if cn > en:
         return 'cn'
 
@@ -107,6 +76,157 @@ def detect_language(text, fast=True):
     
     return 'en'
 
+# bits of the classes of characters searched by detect_language, with the regex matching each class
+HIRAGANA, HAN, FRANCAIS, GERMAN, ARABIC, HANGUL, CYRILLIC, LATIN, HAN2, LETTER, NUMBER, PUNCTUATION = (1 << i for i in range(12))
+scripts = {
+    HIRAGANA: Hiragana.pattern,
+    HAN: Han.pattern,
+    FRANCAIS: Francais.pattern,
+    GERMAN: German.pattern,
+    ARABIC: Arabic.pattern,
+    HANGUL: Hangul.pattern,
+    # Russian is a subset of Ukrainian
+    CYRILLIC: '[А-Яа-яҐґІіЇїЄє]',
+    LATIN: '[a-zA-Z]',
+    LETTER: r'\p{Letter}',
+    NUMBER: r'\p{Number}',
+    PUNCTUATION: r'\p{Punctuation}',
+}
+
+@functools.cache
+def script_table():
+    '''
+    numpy array mapping each codepoint to the bits of the classes it belongs to, built once by scanning all codepoints with the regex of each class
+    '''
+    import numpy as np
+    table = np.zeros(0x110000, np.uint16)
+    codepoints = ''.join(map(chr, range(0x110000)))
+    for bit, pattern in scripts.items():
+        for m in re.finditer(f'(?:{pattern})+', codepoints):
+            table[m.start():m.end()] |= bit
+    return table
+
+def script_bits(texts):
+    '''
+    bits of the classes of characters found in each of texts, scanned in one pass over the UTF-32 array of their concatenation;
+    HAN2 is set if a text has two consecutive Han characters.
+    '''
+    import numpy as np
+    codes = np.frombuffer(''.join(texts).encode('utf-32-le', 'surrogatepass'), np.uint32)
+    bits = script_table()[codes]
+    lengths = np.fromiter(map(len, texts), np.int64, len(texts))
+    starts = np.cumsum(lengths) - lengths
+    han = (bits & HAN) != 0
+    han2 = han[:-1] & han[1:]
+    # a pair of Han characters does not span two texts
+    han2[starts[(starts > 0) & (starts < len(codes))] - 1] = False
+    bits[:-1] |= np.where(han2, HAN2, 0).astype(np.uint16)
+
+    result = np.zeros(len(texts), np.uint16)
+    nonempty = lengths > 0
+    if nonempty.any():
+        result[nonempty] = np.bitwise_or.reduceat(bits, starts[nonempty])
+    return result.tolist()
+
+def detect_language_from_bits(text, bits):
+    # the same decisions as detect_language(text, fast=True), with the searches of character classes replaced by the bits of text
+    if bits & HIRAGANA:
+        return 'jp'
+
+    if bits & (HAN if len(text) <= 2 else HAN2):
+        return 'cn'
+
+    if bits & FRANCAIS:
+        return 'fr'
+
+    if bits & GERMAN:
+        return 'de'
+
+    if bits & ARABIC:
+        return 'ar'
+
+    if bits & HANGUL:
+        return 'kr'
+
+    # both regex of mathematical formula match only texts containing one of these
+    if ' = ' in text or ' ≤ ' in text or ' ≥ ' in text:
+        if m := re.match(r'\s*([^\n]*) = ([^\n]*)\s*$', text):
+            if re.fullmatch(r'\w+', m[1]) or re.search('[^*/+-]', m[1]):
+                if re.search('[^*/+-]', m[2]):
+                    return 'math'
+        if m := re.match(r'\s*([^\n]*) [≤≥] ([^\n]*)\s*$', text):
+            return 'math'
+
+    if bits & CYRILLIC:
+        return 'ru'
+
+    if bits & LATIN:
+        if bits & HAN:
+            return
+        return 'en'
+
+def weighted_scores(text):
+    '''
+    the scores of Chinese and English of detect_language(text, fast=False), each character weighted by the square of its relative distance to the middle of text:
+    a Han letter adds 8 times its weight to Chinese, a number or punctuation beyond Latin-1 twice its weight, and any other letter, number or punctuation its weight to English.
+    '''
+    import numpy as np
+    if not text:
+        return 0, 0
+    codes = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), np.uint32)
+    bits = script_table()[codes]
+    letter = (bits & LETTER) != 0
+    han = letter & ((bits & HAN) != 0)
+    counted = (bits & (NUMBER | PUNCTUATION)) != 0
+    wide = counted & (codes > 256)
+    cn_factor = np.where(han, 8.0, np.where(wide, 2.0, 0.0))
+    en_factor = letter & ~han | counted & ~wide
+
+    def scores(weight):
+        # summed by accumulate in the order of the characters, to the same floats as summed character by character
+        return np.add.accumulate(cn_factor * weight)[-1], np.add.accumulate(np.where(en_factor, weight, 0.0))[-1]
+
+    mid = len(text) / 2
+    cn, en = scores(np.square((np.arange(len(text)) - mid + 0.01) / mid))
+    # x ** 2 of python is pow of libm, which may differ from x * x in the last bit, so that the scores may differ from those of the character by character loop by
+    # (len(text) + 2) ulps of their sum at most, which matters for ties only: then the weights are computed by python instead
+    if abs(cn - en) <= (len(text) + 2) * 2 ** -50 * (cn + en) and cn + en:
+        cn, en = scores(np.array([((i - mid + 0.01) / mid) ** 2 for i in range(len(text))]))
+    return cn, en
+
+# languages detected so far, shared by all documents and threads under languages_lock, the least recently used evicted beyond max_languages texts
+languages = collections.OrderedDict()
+languages_lock = threading.Lock()
+max_languages = 1 << 16
+
+def detect_languages(texts):
+    '''
+    batched detect_language(text, fast=True) over texts, classifying the characters of all the texts not seen before in one vectorized pass.
+    returns the list of the languages of texts.
+    '''
+    # the languages of this call are gathered in a dict of its own, so that evicting from the memo cannot lose any of them
+    found = {}
+    with languages_lock:
+        for text in texts:
+            if text not in found and text in languages:
+                languages.move_to_end(text)
+                found[text] = languages[text]
+    unseen = [*{text: None for text in texts if text not in found}]
+    if unseen:
+        for text, bits in zip(unseen, script_bits(unseen)):
+            found[text] = detect_language_from_bits(text, bits)
+        with languages_lock:
+            for text in unseen:
+                languages[text] = found[text]
+            while len(languages) > max_languages:
+                languages.popitem(last=False)
+    return [found[text] for text in texts]
+
+@functools.lru_cache(maxsize=1 << 14)
+def split_sentences(text):
+    # sentences of sbd(text), cached since the same texts recur across answers
+    return tuple(text[start:stop] for start, stop in sbd_spans(text))
+
 
 @__set__(Markdown, XMLParser)
 def language_consistency(self, *_):
@@ -114,34 +234,48 @@ def language_consistency(self, *_):
 
 @__set__(MarkdownArgs)
 def language_consistency(self, lang, min_scan_length, ignores):
-    for arg in self.args:
-        if type(arg) in ignores:
-            continue
-        yield from arg.language_consistency(lang, min_scan_length, ignores)
+    # walk down through MarkdownArgs only, skipping the ignored types together with their subtrees
+    def prune(node):
+        return node is not self and (type(node) in ignores or not isinstance(node, (MarkdownArgs, MarkdownText)))
+
+    texts = [*self.dfs(types=MarkdownText, prune=prune)]
+    sentences = [split_sentences(text.text) for text in texts]
+    # detect the languages and measure the utf-8 lengths of the sentences of all the texts in one batch
+    sentences_all = [ans for sentences in sentences for ans in sentences]
+    languages = iter(detect_languages(sentences_all))
+    scan_lengths = iter(utf8_lengths(sentences_all))
+    for text, sentences in zip(texts, sentences):
+        yield from text.language_inconsistency(sentences, languages, scan_lengths, lang, min_scan_length)
 
 @__set__(MarkdownText)
 def language_consistency(self, lang, min_scan_length, _):
+    sentences = split_sentences(self.text)
+    yield from self.language_inconsistency(sentences, iter(detect_languages(sentences)), iter(utf8_lengths(sentences)), lang, min_scan_length)
+
+@__set__(MarkdownText)
+def language_inconsistency(self, sentences, languages, scan_lengths, lang, min_scan_length):
+    # languages and scan_lengths iterate over the languages detected for sentences and their utf-8 lengths
     start_idx = self.start_idx
     end_idx = start_idx
-    for ans in sbd(self.text):
+    for ans in sentences:
+        lang_ = next(languages)
+        scan_length = next(scan_lengths)
         end_idx = start_idx + len(ans)
         hit = False
         if '\ufffd' in ans:
             # '�', Unicode Replacement Character, causing gibberish 
-            scan_length = len(ans.encode())
             hit = True
         elif re.search(r'\w+', ans):
-            if lang_ := detect_language(ans):
+            if lang_:
                 if lang_ != 'math' and lang != lang_:
                     if lang not in ('en', 'de', 'fr') or lang_ not in ('en', 'de', 'fr'):
-                        scan_length = len(ans.encode())
                         hit = scan_length >= min_scan_length
         if hit:
             yield {'text': ans, 'index': start_idx, 'tagName': self.parent.func, 'scan_length': scan_length}
         start_idx = end_idx
 
 @default_on_error({'score' : -30})
-def language_consistency(text, answer, lang=None, min_scan_length=32, ignores=["MarkdownA", "MarkdownB", "MarkdownBracket", "MarkdownLatex", "MarkdownCODE", "MarkdownPreCode", "MarkdownTABLE"], **_):
+def language_consistency(text, answer, lang=None, min_scan_length=32, ignores=["MarkdownA", "MarkdownB", "MarkdownBracket", "MarkdownLatex", "MarkdownCODE", "MarkdownPreCode", "MarkdownTABLE"], tree=None, **_):
     '''
     Validate and score answer content based on language consistency, ignoring code blocks and tables.
 
@@ -153,6 +287,7 @@ def language_consistency(text, answer, lang=None, min_scan_length=32, ignores=["
         text (str, optional): Reference text used for language detection if lang isn't provided.
         lang (str, optional): Target language code (e.g., 'en', 'de'). If None, detected from `text`.
         min_scan_length (int, optional): minimum length of the inconsistent text piece
+        tree (MarkdownArgs, optional): markdown tree already built from convert_block_latex(answer), so as not to build it again
 
     Returns:
         dict: Result dictionary containing:
@@ -172,8 +307,8 @@ def language_consistency(text, answer, lang=None, min_scan_length=32, ignores=["
             lang = 'en'
     else:
         lang = lang.lower()
-    answer = convert_block_latex(answer)
-    tree = MarkdownParser.instance.build(answer)
+    if tree is None:
+        tree = MarkdownParser.instance.build(convert_block_latex(answer))
     error = []
     score = 0
     for obj in tree.language_consistency(
@@ -260,6 +395,113 @@ def test():
     result = language_consistency(None, text, lang='cn')
     print('result =', result)
 
+def test_detect_languages(folder='std/src/hash/test/', repeat=5):
+    '''
+    check that detect_languages agrees with detect_language on the sentences of the files under folder and on random mixed-script texts,
+    and print the time spent by both on the sentences, with and without the languages memoized.
+    '''
+    import time, random
+    from std import listdir
+
+    sentences = []
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            sentences += sbd(f.read())
+
+    rand = random.Random(0)
+    alphabet = 'aZ 1=≤≥+-*/\nあ中文字éßالعربية한국어ДЖґЄ.,!ü '
+    texts = [''.join(rand.choice(alphabet) for _ in range(rand.randint(0, 12))) for _ in range(20000)]
+    texts += [f' {a} = {b} ' for a, b in zip(texts[::2], texts[1::2])]
+    languages.clear()
+    assert detect_languages(texts) == [detect_language(text) for text in texts], 'detect_languages differs from detect_language'
+
+    # a memo far smaller than the texts of one call evicts while they are detected, without losing any of them
+    global max_languages
+    max_languages, bound = 4, max_languages
+    languages.clear()
+    try:
+        for _ in range(2):
+            assert detect_languages(texts[:100]) == [detect_language(text) for text in texts[:100]], 'detect_languages differs once the memo is full'
+            assert len(languages) <= max_languages, 'the memo exceeds its bound'
+    finally:
+        max_languages = bound
+
+    script_table()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        expected = [detect_language(ans) for ans in sentences]
+    per_sentence = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        languages.clear()
+        result = detect_languages(sentences)
+    batched = time.perf_counter() - start
+    assert result == expected, 'detect_languages differs from detect_language'
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        detect_languages(sentences)
+    memoized = time.perf_counter() - start
+    print(f'{len(sentences)} sentences: per sentence {per_sentence / repeat:.4f}s, batched {batched / repeat:.4f}s, memoized {memoized / repeat:.4f}s')
+
+def test_weighted_scores(folder='std/src/hash/test/'):
+    '''
+    check that detect_language(text, fast=False) makes the same decisions as its former character by character loop, on the files under folder and on random mixed-script texts,
+    and print the time spent by both on the files.
+    '''
+    import time, random
+    from std import listdir
+
+    def detect_language_by_characters(text):
+        if Han2.match(text):
+            return 'cn'
+        cn = 0
+        en = 0
+        mid = len(text) / 2
+        for i, ch in enumerate(text):
+            position_weight = (i - mid + 0.01) / mid
+            position_weight = position_weight ** 2
+            if re.compile(r'\p{Letter}').match(ch):
+                if Han.match(ch):
+                    cn += 8 * position_weight
+                else:
+                    en += position_weight
+            elif re.compile(r'\p{Number}').match(ch):
+                if ord(ch) > 256:
+                    cn += 2 * position_weight
+                else:
+                    en += position_weight
+            elif re.compile(r'\p{Punctuation}').match(ch):
+                if ord(ch) > 256:
+                    cn += 2 * position_weight
+                else:
+                    en += position_weight
+        return 'cn' if cn > en else 'en'
+
+    texts = []
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+
+    rand = random.Random(0)
+    alphabet = 'ab 1１,，。!中文字々〇ⅫДé\u0301\U00020000$+'
+    samples = [''.join(rand.choice(alphabet) for _ in range(rand.randint(0, 40))) for _ in range(20000)]
+    # texts symmetric around their middle, where the scores are the closest to a tie
+    samples += [text + text[::-1] for text in samples[:5000]]
+    for text in samples:
+        assert detect_language(text, fast=False) == detect_language_by_characters(text), f'{text!r}: decisions differ'
+
+    script_table()
+    start = time.perf_counter()
+    expected = [detect_language_by_characters(text) for text in texts]
+    by_characters = time.perf_counter() - start
+    start = time.perf_counter()
+    result = [detect_language(text, fast=False) for text in texts]
+    weighted = time.perf_counter() - start
+    assert result == expected, 'decisions differ'
+    print(f'{len(texts)} texts of {sum(map(len, texts))} characters: character by character {by_characters:.4f}s, weighted_scores {weighted:.4f}s, speedup {by_characters / weighted:.1f}x')
+
 if __name__ == '__main__':
     # test()
     test_batch(
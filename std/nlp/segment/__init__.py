@@ -1,4 +1,5 @@
 import regex as re
+from functools import singledispatch
 
 dot_lookbehind = [
     r'\b([a-z]+|[A-Z][a-z]*)\s+\d+',
@@ -145,6 +146,180 @@ def sbd(text):
     assert ''.join(texts) == leadingDelimiters + text
     return texts
 
+leading_delimiters = re.compile(r'[;!?；！？…。\s]+')
+fragment_regex = re.compile(r"[^;!?；！？…。\r\n]+[;!?；！？…。\s]*")
+english_sentence_regex = re.compile(englishSentenceRegex)
+boundary_regex = re.compile(r'.[;.!?:；。！？：…\r\n]+')
+whitespace_regex = re.compile(r'\s+')
+trailing_blanks_regex = re.compile(r'(?<=\n)[ \t]+$')
+factorial_regex = re.compile(r'\b[a-z\d]! *$')
+factorial_operator_regex = re.compile(' *[*-*/()]')
+
+def merge_next_span(text, spans, start, stop):
+    '''
+    merge_next_line over the spans of text, with text[start:stop] as the next line:
+    returns the start of the span of the next line, or None if it has been merged into the last span.
+    '''
+    if spans:
+        last = spans[-1]
+        prev_start, prev_stop = last
+        # both regex of merge_next_line end with one of ' \t!' right before the end of prevLine or before its final newline,
+        # so that prevLine is copied only then, the lookbehind and \b not seeing past its start as in merge_next_line
+        end = prev_stop - 1 if prev_stop - prev_start > 1 and text[prev_stop - 1] == '\n' else prev_stop
+        if end > prev_start and text[end - 1] in ' \t!':
+            prevLine = text[prev_start:prev_stop]
+            if m := trailing_blanks_regex.search(prevLine):
+                last[1] = prev_start + m.start()
+                return last[1]
+            elif factorial_regex.search(prevLine) and factorial_operator_regex.match(text, start, stop):
+                last[1] = stop
+                return
+    return start
+
+def english_sentence_spans(text, start, stop):
+    # cuts text[start:stop] the same as englishSentenceRegex, searched in the substring only if it has a dot, since its lookbehind must not see past the start of the line
+    if text.find('.', start, stop) < 0 and text.find('．', start, stop) < 0:
+        return [[start, stop]]
+    spans = []
+    end = start
+    for m in english_sentence_regex.finditer(text[start:stop]):
+        spans.append([end, end := start + m.end()])
+    spans.append([end, stop])
+    return spans
+
+@singledispatch
+def sbd_spans(text):
+    '''
+    sentence boundary detection of sbd as the (start, stop) offsets of the sentences in text, without building the sentences:
+    a single scan over the fragments of text with the regex compiled once, text[start:stop] being the sentences returned by sbd(text).
+    given a list of texts, returns the list of the spans of each.
+    '''
+    size = len(text)
+    m = leading_delimiters.match(text)
+    offset = m.end() if m else 0
+
+    spans = []
+    hasContext = False
+    for m in fragment_regex.finditer(text, offset):
+        start, end = m.span()
+        if text[start] not in '’”':
+            if end < size and text[end] in '")]}）】｝’”':
+                if hasContext:
+                    spans[-1][1] = end
+                else:
+                    if (start := merge_next_span(text, spans, start, end)) is not None:
+                        spans.append([start, end])
+                    hasContext = True
+                continue
+
+            sentences = english_sentence_spans(text, start, end)
+            if hasContext:
+                spans[-1][1] = sentences[0][1]
+                sentences = sentences[1:]
+                hasContext = False
+            if spans and sentences:
+                if (start := merge_next_span(text, spans, *sentences[0])) is None:
+                    sentences = sentences[1:]
+                else:
+                    sentences[0][0] = start
+            spans += sentences
+            continue
+
+        hasContext = False
+        boundaryIndex = 0
+        if end - start > 1 and text[start + 1] in ',)]}，）】｝》、的':
+            if text[start + 1:start + 3] == '的确':
+                boundaryIndex = 1
+            elif spans:
+                spans[-1][1] = end
+            else:
+                spans = [[start, end]]
+        else:
+            m = boundary_regex.match(text, start, end)
+            boundaryIndex = m.end() - start if m else 1
+
+        if boundaryIndex:
+            if not spans:
+                spans.append([start, start])
+            latter = spans[-1][1] = start + boundaryIndex
+            if latter < end:
+                if m := whitespace_regex.match(text, latter, end):
+                    latter = spans[-1][1] = m.end()
+                    if latter == end:
+                        continue
+                spans.append([latter, end])
+
+    if offset:
+        if spans:
+            spans[0][0] = 0
+        else:
+            spans.append([0, offset])
+    return [(start, stop) for start, stop in spans]
+
+@sbd_spans.register(list)
+def _(texts):
+    return [sbd_spans(text) for text in texts]
+
+newline_regex = re.compile('[^\n]+')
+
+def paragraph_spans(text):
+    '''
+    the (start, stop) offsets in text of the paragraphs [paragraph.strip() for paragraph in re.split('\\n+', text.strip())], without building them
+    '''
+    start = 0
+    stop = len(text)
+    while start < stop and text[start].isspace():
+        start += 1
+    while stop > start and text[stop - 1].isspace():
+        stop -= 1
+    if start == stop:
+        return [(0, 0)]
+
+    spans = []
+    for m in newline_regex.finditer(text, start, stop):
+        start, stop = m.span()
+        while start < stop and text[start].isspace():
+            start += 1
+        while stop > start and text[stop - 1].isspace():
+            stop -= 1
+        spans.append((start, stop))
+    return spans
+
+def test_sbd_spans(folder='std/src/hash/test/', count=20000):
+    '''
+    check that sbd_spans cuts the same sentences as sbd, on the lines of the files under folder and on random texts made of the tokens sbd is sensitive to,
+    and print the time spent by both on the files.
+    '''
+    import time, random
+    from std import listdir
+
+    texts = []
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            text = f.read()
+        texts.append(text)
+        texts += text.split('\n\n')
+
+    rand = random.Random(0)
+    tokens = [
+        'a', 'word', 'Word', 'WORD', 'K', 'Jr', 'U.S.A', 'vs', 'etc', 's.t', 'DC', '2023', 'A1', '中文', '的', '的确', '®',
+        ' ', '  ', '\t', '\n', '\n  ', '\r\n', '.', '．', '. ', '! ', '!', '?', ';', '；', '。', '！', '？', '…', ':', '：',
+        ',', '，', '、', '》', '(', ')', '）', '】', '｝', ']', '}', '"', "'", '`', '“', '”', '‘', '’', '|', '*', '/', '-', 'n!',
+    ]
+    samples = [''.join(rand.choice(tokens) for _ in range(rand.randint(0, 30))) for _ in range(count)]
+    for text in texts + samples:
+        assert [text[start:stop] for start, stop in sbd_spans(text)] == sbd(text), f'{text!r}: sentences differ'
+    assert sbd_spans(samples[:100]) == [sbd_spans(text) for text in samples[:100]]
+
+    start = time.perf_counter()
+    for text in texts:
+        sbd(text)
+    cost = time.perf_counter() - start
+    start = time.perf_counter()
+    sbd_spans(texts)
+    spans_cost = time.perf_counter() - start
+    print(f'{len(texts)} texts: sbd {cost:.3f}s, sbd_spans {spans_cost:.3f}s, speedup {cost / spans_cost:.2f}x')
+
 if __name__ == '__main__':
     text = [
         'Some of the best genealogy sites also offer best DNA testing kits, which offer a new avenue for finding relatives [2]. You can access some of the best DNA testing kits via these websites, which can reveal information about your ancient ancestors [2]. These specialized platforms hold digitized versions of things like census records, marriage certificates, and ship passenger information [1]. For example, some of these services also offer some the best family tree makers, which allows you to keep a visual record of your findings [1].' ,
@@ -0,0 +1,185 @@
+import os, glob, time, zlib, pickle, sqlite3, hashlib, inspect, functools, threading
+
+
+@functools.cache
+def fingerprint():
+    '''
+    hash of the sources of the parser modules, so that any change to the parsers invalidates the trees cached before it
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    for file in sorted(glob.glob(os.path.join(os.path.dirname(__file__), '*.py'))):
+        with open(file, 'rb') as f:
+            h.update(f.read())
+    return h.digest()
+
+
+class ParseCache:
+    '''
+    on-disk cache of parsed trees, stored in a sqlite file at path and keyed by the hash of the parser fingerprint, the parser class and the text.
+    a tree is stored as its zlib-compressed pickle, together with the warnings collected while building it;
+    once the stored trees exceed max_bytes, the least recently used ones are evicted down to 90% of max_bytes.
+    usage:
+        MarkdownParser.cache = ParseCache('markdown.db')    # or AbstractParser.cache to cache all parsers
+    '''
+    def __init__(self, path, max_bytes=1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        # one connection per thread and per process, since a sqlite connection can be shared by neither
+        local = self.local
+        if getattr(local, 'pid', None) != (pid := os.getpid()):
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute('pragma journal_mode = wal')
+            connection.executescript('''
+                begin;
+                create table if not exists tree (key blob primary key, value blob, size integer, atime real);
+                create index if not exists tree_atime on tree (atime);
+                create table if not exists meta (size integer);
+                insert into meta select 0 where not exists (select * from meta);
+                create trigger if not exists tree_insert after insert on tree begin update meta set size = size + new.size; end;
+                create trigger if not exists tree_delete after delete on tree begin update meta set size = size - old.size; end;
+                commit;
+            ''')
+            local.connection = connection
+            local.pid = pid
+        return local.connection
+
+    def key(self, cls, text):
+        h = hashlib.blake2b(fingerprint(), digest_size=16)
+        h.update(cls.__qualname__.encode())
+        h.update(b'\0')
+        h.update(text.encode('utf-8', 'surrogatepass'))
+        return h.digest()
+
+    def get(self, key):
+        connection = self.connection
+        if row := connection.execute('select value from tree where key = ?', (key,)).fetchone():
+            connection.execute('update tree set atime = ? where key = ?', (time.time(), key))
+            return pickle.loads(zlib.decompress(row[0]))
+
+    def set(self, key, value):
+        value = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        connection = self.connection
+        # the value of a key never changes, so a tree stored meanwhile by another process can be kept
+        connection.execute('insert or ignore into tree values (?, ?, ?, ?)', (key, value, len(value), time.time()))
+        size, = connection.execute('select size from meta').fetchone()
+        if size > self.max_bytes:
+            self.evict(size - self.max_bytes * 0.9)
+
+    def evict(self, size):
+        keys = []
+        for key, value_size in self.connection.execute('select key, size from tree order by atime'):
+            keys.append((key,))
+            size -= value_size
+            if size <= 0:
+                break
+        self.connection.executemany('delete from tree where key = ?', keys)
+
+    def __len__(self):
+        return self.connection.execute('select count(*) from tree').fetchone()[0]
+
+    @property
+    def size(self):
+        return self.connection.execute('select size from meta').fetchone()[0]
+
+
+def cache_build(build):
+    '''
+    decorator of the build method of a parser: if the parser class has a cache, the tree is looked up there first,
+    and stored there once built, along with the warnings collected while building it if build takes a warning list,
+    and the state build leaves the parser in, such as its caret, which is restored on a hit as if the text had been built.
+    '''
+    takes_warning = 'warning' in inspect.signature(build).parameters
+
+    @functools.wraps(build)
+    def wrapper(self, text, *args, **kwargs):
+        if (cache := self.cache) is None:
+            return build(self, text, *args, **kwargs)
+
+        if takes_warning:
+            if 'warning' in kwargs:
+                warning = kwargs.pop('warning')
+            elif args:
+                warning, *args = args
+            else:
+                warning = None
+        key = cache.key(self.__class__, text)
+        try:
+            value = cache.get(key)
+        except Exception:
+            value = None
+
+        if value is None:
+            if takes_warning:
+                root = build(self, text, built_warning := [], *args, **kwargs)
+            else:
+                root = build(self, text, *args, **kwargs)
+                built_warning = None
+            try:
+                # the root and the caret are pickled together, so that the caret is still a node of the tree once loaded
+                cache.set(key, (root, vars(self), built_warning))
+            except Exception:
+                # trees that cannot be pickled (too deep or holding unpicklable objects) are simply not cached
+                ...
+        else:
+            root, state, built_warning = value
+            vars(self).update(state)
+
+        if takes_warning and warning is not None:
+            warning.extend(built_warning)
+        return root
+
+    return wrapper
+
+
+def test(folder='std/src/hash/test/'):
+    '''
+    build the markdown files under folder twice with a cache in a temporary directory:
+    check that the warm pass returns the same trees and warnings, and leaves the parser with the same caret, as the cold one, print the time spent by each,
+    then check that a cache bounded to a third of that size evicts the least recently used trees.
+    '''
+    import tempfile
+    from std import listdir
+    from std.parser.markdown import MarkdownParser
+
+    texts = []
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        MarkdownParser.cache = cache = ParseCache(os.path.join(tmpdir, 'markdown.db'))
+        try:
+            passes = []
+            for _ in range(2):
+                start = time.perf_counter()
+                trees = []
+                for text in texts:
+                    warning = []
+                    parser = MarkdownParser.instance
+                    try:
+                        root = parser.build(text, warning)
+                    except Exception as e:
+                        trees.append(repr(e))
+                        continue
+                    caret = parser.caret
+                    trees.append((str(root), root.html, warning, parser.root is root, caret.func, caret.start_idx, any(node is caret for node in root.dfs())))
+                passes.append((time.perf_counter() - start, trees))
+            (cold, trees), (warm, cached_trees) = passes
+            assert trees == cached_trees, 'cached trees differ from the built ones'
+            print(f'{len(cache)} trees in {cache.size} bytes: cold pass {cold:.3f}s, warm pass {warm:.3f}s, speedup {cold / warm:.2f}x')
+
+            MarkdownParser.cache = cache = ParseCache(os.path.join(tmpdir, 'bounded.db'), max_bytes=cache.size // 3)
+            for text in texts:
+                try:
+                    MarkdownParser.instance.build(text)
+                except Exception:
+                    ...
+            assert cache.size <= cache.max_bytes, 'the cache exceeds its bound'
+            assert cache.get(cache.key(MarkdownParser, texts[-1])) is not None, 'the most recently used tree was evicted'
+            print(f'bounded to {cache.max_bytes} bytes: {len(cache)} trees in {cache.size} bytes')
+        finally:
+            MarkdownParser.cache = None
@@ -0,0 +1,279 @@
+import mmap, struct
+from std import computed
+from std.parser.node import Node
+
+# layout of an encoded tree, in native byte order with the arrays 4-byte aligned:
+#   header: magic, version, number of nodes, number of types, byte length of the type table, byte length of the source text
+#   type table: the utf-8 func names of the node types separated by '\n', padded to 4 bytes
+#   type flags: one byte per type, bit 0 set if the type answers span queries (MarkdownArgs), padded to 4 bytes
+#   node arrays: int32 type id, parent, first child, child count, start_idx, end_idx, one column each, nodes laid out breadth first
+#   source text: utf-8, lone surrogates passed through
+# laying the nodes out breadth first keeps the children of a node contiguous, so that args is a range of node indices.
+magic = b'STDT'
+version = 1
+header = struct.Struct('=4s5I')
+columns = ('type', 'parent', 'first', 'count', 'start_idx', 'end_idx')
+
+
+def pad(data):
+    return data + b'\0' * (-len(data) % 4)
+
+
+def dumps(root, text=None):
+    '''
+    encode the tree rooted at root into bytes, along with the source text if given, so that the nodes can refer to slices of it
+    '''
+    from array import array
+    nodes = [root]
+    parent = array('i', [-1])
+    first = array('i')
+    count = array('i')
+    for i, node in enumerate(nodes):
+        args = getattr(node, 'args', None) or ()
+        first.append(len(nodes))
+        count.append(len(args))
+        nodes.extend(args)
+        parent.extend([i] * len(args))
+
+    types = {}
+    type = array('i')
+    start_idx = array('i')
+    end_idx = array('i')
+    for node in nodes:
+        cls = node.__class__
+        func = node.func if isinstance(node, Node) else cls.__name__
+        type.append(types.setdefault((func, hasattr(cls, 'span')), len(types)))
+        try:
+            start = node.start_idx
+            end = node.end_idx
+        except Exception:
+            start = end = -1
+        start_idx.append(start)
+        end_idx.append(end)
+
+    names = '\n'.join(func for func, _ in types).encode()
+    flags = bytes(int(span) for _, span in types)
+    text = b'' if text is None else text.encode('utf-8', 'surrogatepass')
+    data = [header.pack(magic, version, len(nodes), len(types), len(names), len(text)), pad(names), pad(flags)]
+    for column in (type, parent, first, count, start_idx, end_idx):
+        data.append(column.tobytes())
+    data.append(text)
+    return b''.join(data)
+
+
+def dump(root, file, text=None):
+    with open(file, 'wb') as f:
+        f.write(dumps(root, text))
+
+
+def loads(buffer):
+    '''
+    a lazy read-only view of the tree encoded in buffer (bytes, bytearray or mmap), without copying the node arrays
+    '''
+    return TreeView(buffer).root
+
+
+def load(file):
+    '''
+    mmap the encoded tree in file and return a lazy read-only view of it, whose mmap is closed by view.tree.close() or on leaving a with block on view.tree
+    '''
+    with open(file, 'rb') as f:
+        return loads(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class TreeView:
+
+    def __init__(self, buffer):
+        buffer = memoryview(buffer)
+        tag, ver, size, types, names, text = header.unpack_from(buffer)
+        assert tag == magic and ver == version, 'not an encoded tree'
+        offset = header.size
+        self.funcs = bytes(buffer[offset:offset + names]).decode().split('\n') if types else []
+        offset += names + (-names % 4)
+        self.flags = bytes(buffer[offset:offset + types])
+        offset += types + (-types % 4)
+        for name in columns:
+            setattr(self, name, buffer[offset:offset + 4 * size].cast('i'))
+            offset += 4 * size
+        self.source = buffer[offset:offset + text]
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.type)
+
+    @computed
+    def text(self):
+        # the source text is decoded once, on the first access to the text of a node
+        return bytes(self.source).decode('utf-8', 'surrogatepass')
+
+    @property
+    def root(self):
+        return NodeView(self, 0)
+
+    def close(self):
+        # release the views into the buffer, then close it if it is a mmap; the nodes cannot be read afterwards
+        obj = self.buffer.obj
+        for name in (*columns, 'source', 'buffer'):
+            getattr(self, name).release()
+        if isinstance(obj, mmap.mmap):
+            obj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class NodeView:
+    '''
+    read-only view of a node of an encoded tree, with the traversal and query API of Node
+    '''
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and self.tree is other.tree and self.index == other.index
+
+    def __hash__(self):
+        return hash(self.index)
+
+    def __repr__(self):
+        return f'{self.func}[{self.start_idx}:{self.end_idx}]'
+
+    @property
+    def func(self):
+        tree = self.tree
+        return tree.funcs[tree.type[self.index]]
+
+    @property
+    def parent(self):
+        if (parent := self.tree.parent[self.index]) >= 0:
+            return NodeView(self.tree, parent)
+
+    @property
+    def args(self):
+        tree = self.tree
+        first = tree.first[self.index]
+        return [NodeView(tree, i) for i in range(first, first + tree.count[self.index])]
+
+    @property
+    def start_idx(self):
+        return self.tree.start_idx[self.index]
+
+    @property
+    def end_idx(self):
+        return self.tree.end_idx[self.index]
+
+    @property
+    def text(self):
+        # the slice of the source text spanned by the node
+        return self.tree.text[self.start_idx:self.end_idx]
+
+    @property
+    def root(self):
+        return self.tree.root
+
+    dfs_preorder = Node.dfs_preorder
+    dfs_preorder_reversed = Node.dfs_preorder_reversed
+    dfs_postorder = Node.dfs_postorder
+    dfs_postorder_reversed = Node.dfs_postorder_reversed
+    dfs = Node.dfs
+    bfs = Node.bfs
+    compareTo = Node.compareTo
+
+    def span(self, indices):
+        '''
+        the same node as MarkdownArgs.span on the tree that was encoded, searched over the node arrays without creating a view per child
+        '''
+        tree = self.tree
+        start_idx = tree.start_idx
+        end_idx = tree.end_idx
+        index = self.index
+        while True:
+            begin = tree.first[index]
+            end = stop = begin + tree.count[index]
+            while begin < end:
+                mid = begin + end >> 1
+                if end_idx[mid] <= indices.start_idx:
+                    begin = mid + 1
+                elif start_idx[mid] >= indices.end_idx:
+                    end = mid
+                else:
+                    begin = mid
+                    break
+            if begin == stop:
+                return None
+            if tree.flags[tree.type[begin]] & 1 and start_idx[begin] < indices.end_idx:
+                index = begin
+                continue
+            return NodeView(tree, begin)
+
+
+def test(folder='std/src/hash/test/'):
+    '''
+    encode the markdown trees built from the files under folder, load them back through mmap,
+    check that the views have the same func, offsets, dfs, bfs and span as the trees and that the source text is kept as is, and print the sizes and times of columnar encoding and pickle.
+    '''
+    import os, time, pickle, random, tempfile
+    from std import listdir, Object
+    from std.parser.markdown import MarkdownParser
+
+    rand = random.Random(0)
+    cost = [0, 0, 0, 0]
+    size = [0, 0]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+            with open(file, 'r', encoding='utf-8') as f:
+                text = f.read()
+            try:
+                root = MarkdownParser().build(text)
+            except Exception:
+                continue
+
+            start = time.perf_counter()
+            data = dumps(root, text)
+            cost[0] += time.perf_counter() - start
+            start = time.perf_counter()
+            pickled = pickle.dumps(root)
+            cost[1] += time.perf_counter() - start
+            size[0] += len(data)
+            size[1] += len(pickled)
+
+            path = os.path.join(tmpdir, os.path.basename(file))
+            with open(path, 'wb') as f:
+                f.write(data)
+            start = time.perf_counter()
+            with load(path).tree as tree:
+                view = tree.root
+                cost[2] += time.perf_counter() - start
+                start = time.perf_counter()
+                pickle.loads(pickled)
+                cost[3] += time.perf_counter() - start
+
+                for kwargs in ({}, {'postorder': True}, {'reverse': True}):
+                    for nodes, views in ((root.dfs(**kwargs), view.dfs(**kwargs)), (root.bfs(**kwargs), view.bfs(**kwargs))):
+                        nodes = [*nodes]
+                        views = [*views]
+                        assert [node.func for node in nodes] == [node_view.func for node_view in views], f'{file}: traversals differ'
+
+                for node, node_view in zip(root.dfs(), view.dfs()):
+                    try:
+                        assert (node.start_idx, node.end_idx) == (node_view.start_idx, node_view.end_idx), f'{file}: offsets differ'
+                    except AttributeError:
+                        ...
+
+                nodes = [*root.bfs()]
+                for _ in range(200):
+                    indices = Object(start_idx=(start := rand.randrange(len(text))), end_idx=start + rand.randint(0, 64))
+                    span = root.span(indices)
+                    assert (view.span(indices) is None if span is None else nodes[view.span(indices).index] is span), f'{file}: span differs'
+
+    text = 'lone surrogate \ud83d, then a pair \ud83d\ude00'
+    assert TreeView(dumps(Node(), text)).text == text, 'the source text is not kept as is'
+
+    print(f'columnar: {size[0]} bytes, encoded in {cost[0]:.3f}s, loaded in {cost[2]:.4f}s')
+    print(f'pickle: {size[1]} bytes, encoded in {cost[1]:.3f}s, loaded in {cost[3]:.4f}s')
@@ -1,3 +1,4 @@
+import regex as re
 from .node import AbstractParser, Node, case 
 
 starred_commands = (
@@ -22,6 +23,12 @@ def case(self, **kwargs):
         self.text += self.key
         return self
 
+    inert = re.compile('[%s]*' % ''.join(ascii))
+
+    def push_text(self, text, **kwargs):
+        self.text += text
+        return self
+
     @case(' ')
     def case(self, **kwargs):
         if self.text == "\\":
@@ -49,7 +56,7 @@ def case(self, **kwargs):
         return self.case_default(self.key, **kwargs)
 
     def case_default(self, token, **kwargs):
-        return self.parent.parse(**self.kwargs).parse(token, **kwargs)
+        return self.parent.parse(**self.kwargs_dict).parse(token, **kwargs)
 
     def strFormat(self):
         return self.text
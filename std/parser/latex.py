@@ -3,6 +3,7 @@
 import regex as re, traceback
 from std import computed, array_splice
 from std.parser.node import AbstractParser, Node, Closable, case
+from std.parser.cache import cache_build
 from std.parser.command import CommandParser, starred_commands
 from std.parser.newline import NewLineParser
 
@@ -164,6 +165,12 @@
     r'\mapsto',
 )
 
+# the input_priority of each infix operator together with whether it is right associative, looked up at once by insert_infix
+infix_priority = {operator: (priority, operator in right_associative_operators) for operator, priority in input_priority.items()}
+
+# a command whose name is complete: the backslash and the letters of the name, followed neither by a letter nor by the '*' of a starred command
+command = re.compile(r'\\[a-zA-Z]+(?![a-zA-Z*])')
+
 big_operator_priority = {
     r"\sum" : 67,
     r"\prod"  : 67,
@@ -538,6 +545,12 @@ def push_token(self, word, **kwargs):
             return new
         return super().push_token(word, **kwargs)
 
+    def push_text(self, text, **kwargs):
+        # only letters are glued together, any other character makes a node of its own
+        if text.isalpha():
+            return self.parent.insert_text(self, text, **kwargs)
+        return None
+
     @classmethod
     def match_left_parenthesis(cls, arg):
         return isinstance(arg, cls) and arg.text == '(' and not (isinstance(parent := arg.parent, LatexParenthesisGroup) and isinstance(right := parent.args[-1], LatexText) and right.text == ')')
@@ -606,6 +619,10 @@ def __init__(self, args, parent=None, **kwargs):
     def insert_token(self, caret, word, **kwargs):
         return caret.push_token(word, **kwargs)
 
+    def insert_text(self, caret, text, **kwargs):
+        # a run of letters appended at once, the same as calling insert_token with each of them
+        return caret.push_token(text, **kwargs)
+
     def strFormat(self):
         return ''.join(['%s'] * len(self.args))
 
@@ -628,7 +645,8 @@ def insert_digit(self, caret, digit, **kwargs):
         return new
 
     def insert_infix(self, caret, operator, **kwargs):
-        if input_priority[operator] >= self.input_priority if operator in right_associative_operators else input_priority[operator] > self.input_priority:
+        priority, right_associative = infix_priority[operator]
+        if priority >= self.input_priority if right_associative else priority > self.input_priority:
             op = LatexCommand(operator, **kwargs)
             new = LatexCaret(**kwargs)
             self.replace(caret, LatexInfix(caret, op, new))
@@ -739,6 +757,10 @@ def insert_token(self, caret, word, **kwargs):
             return caret
         return self.parent.insert_token(self, word, **kwargs)
 
+    def insert_text(self, caret, text, **kwargs):
+        # insert_token has a case of its own for the letters, which are thus parsed one by one
+        return None
+
     push_big_operator = LatexNumber.push_big_operator
 
 class LatexUnary(LatexArgs):
@@ -1285,6 +1307,8 @@ def insert_token(self, caret, word, **kwargs):
             self.push(new)
         return new
 
+    insert_text = insert_token
+
     def insert_delimiter(self, caret, delimiter, **kwargs):
         new = LatexText(delimiter, **kwargs)
         self.push(new)
@@ -1380,6 +1404,7 @@ def insert_infix(self, caret, operator, **kwargs):
         return super().insert_infix(caret, operator, **kwargs)
 
     insert_token = LatexArgsNullSeparated.insert_token
+    insert_text = LatexArgsNullSeparated.insert_text
     insert_delimiter = LatexArgsNullSeparated.insert_delimiter
     insert_comma = LatexArgsNullSeparated.insert_comma
     insert_big_operator = LatexArgsNullSeparated.insert_big_operator
@@ -1434,6 +1459,10 @@ def insert_token(self, caret, word, **kwargs):
             self.parent.parent.push(caret)
         return caret.push_token(word, **kwargs)
 
+    def insert_text(self, caret, text, **kwargs):
+        # insert_token has a case of its own for the letters, which are thus parsed one by one
+        return None
+
     def insert_unary(self, this, func, **kwargs):
         if isinstance(self.parent, LatexBigOperator) and len(self.parent.args) == 1 and self.parent.args[0] is self:
             caret = LatexCaret(**kwargs)
@@ -1543,6 +1572,10 @@ def insert_token(self, caret, word, **kwargs):
             self.push(caret)
         return caret
 
+    def insert_text(self, caret, text, **kwargs):
+        # insert_token has a case of its own for the letters, which are thus parsed one by one
+        return None
+
     def insert_left_brace(self, caret, **kwargs):
         if len(self.args) == 2:
             assert caret is self.args[-1]
@@ -1713,10 +1746,43 @@ def build_debug(self, text):
         self.parse('', start_idx=len(text))
         return self.root
 
+    def parse_text(self, text, start_idx=0, warning=None, on_error=None):
+        '''
+        parse text as AbstractParser.parse_text does, except that a complete command met by a latex node is dispatched by the node in one lookup of its name,
+        the same lookup that CommandParser makes once the name ends, without building a Command letter by letter;
+        on_error, if given, is called with the exception raised by a command or a character, whose backslash or character is then skipped
+        '''
+        if warning is not None:
+            return super().parse_text(text, start_idx, warning, on_error)
+
+        i = 0
+        size = len(text)
+        while i < size:
+            j = text.find('\\', i)
+            if j < 0:
+                j = size
+            if j > i:
+                super().parse_text(text[i:j], start_idx + i, on_error=on_error)
+                if j == size:
+                    break
+            try:
+                if isinstance(self.caret, LatexNode) and (m := command.match(text, j)):
+                    self.parse(m[0], start_idx=start_idx + j)
+                    i = m.end()
+                else:
+                    self.parse('\\', start_idx=start_idx + j)
+                    i = j + 1
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(e)
+                i = j + 1
+        return self.caret
+
+    @cache_build
     def build(self, text):
         self.init()
-        for start_idx, token in enumerate(text):
-            self.parse(token, start_idx=start_idx)
+        self.parse_text(text)
         self.parse('', start_idx=len(text))
         return self.root
 
@@ -1736,6 +1802,82 @@ def test():
                 exit()
             print(tree)
 
+formulas = [
+    r'x = \frac{-b \pm \sqrt{b^2 - 4ac}}{2a}',
+    r'\int_0^\infty e^{-x^2} \, dx = \frac{\sqrt{\pi}}{2}',
+    r'\sum_{i=1}^{n} i = \frac{n(n+1)}{2}',
+    r'\lim_{x \to 0} \frac{\sin x}{x} = 1',
+    r'\left( \frac{a}{b} \right)^2 \leq \frac{a^2 + b^2}{2 b^2}',
+    r'f(x) = \begin{cases} x^2 & x \geq 0 \\ -x & x < 0 \end{cases}',
+    r'\mathbf{A} = \begin{pmatrix} 1 & 2 \\ 3 & 4 \end{pmatrix}',
+    r'P(A \cup B) = P(A) + P(B) - P(A \cap B)',
+    r'\nabla \cdot \vec{E} = \frac{\rho}{\varepsilon_0}',
+    r'\bigl(\frac{8}{4}+5\bigr)\times 7 \,=\;\big(2+5\big)\times 7 \!=\,7\times 7 \;=\!49',
+    r'\binom{n}{k} = \frac{n!}{k!(n-k)!}',
+    r'\log_2 8 = 3 \quad \text{and} \quad \ln e = 1',
+    r'\overline{AB} \parallel \overline{CD}, \angle ABC = 90^\circ',
+    r'\mathbb{E}[X] = \sum_{x} x \, p(x)',
+    r'\alpha \cdot \beta + \frac{\gamma}{\delta} \times \sin \theta \leq \sqrt{\pi}',
+    r'\section*{Proof} a \Rightarrow b \iff \neg b \Rightarrow \neg a',
+]
+
+def test_commands(folder='std/src/hash/test/', repeat=5):
+    '''
+    check that LatexParser.parse_text, which dispatches complete commands at once, builds the same trees as parsing the text character by character,
+    and as the character-driven AbstractParser.parse_text, on the formulas of the markdown answers under folder, the latex cases under std/parser/test/
+    and the formulas above, spliced together and cut short at random, and print the time spent by each
+    '''
+    import time, random
+    from std import listdir
+    rand = random.Random(0)
+
+    def per_character(parser, text):
+        for i, token in enumerate(text):
+            parser.parse(token, start_idx=i)
+
+    def build(text, parse_text):
+        parser = LatexParser()
+        parser.init()
+        try:
+            parse_text(parser, text)
+            parser.parse('', start_idx=len(text))
+        except RecursionError:
+            return 'RecursionError'
+        except Exception as e:
+            return repr(e)
+        return str(parser.root), [node.func for node in parser.root.dfs()]
+
+    # the formulas of the $$...$$, \\[...\\], \\(...\\) and $...$ blocks of the answers
+    answers = []
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            for m in re.finditer(r'\$\$([\s\S]+?)\$\$|\\\[([\s\S]+?)\\\]|\\\(([\s\S]+?)\\\)|(?<![$\\])\$([^$\n]+?)\$', f.read()):
+                answers.append(next(group for group in m.groups() if group is not None).strip())
+    cases = []
+    for file in sorted(listdir('std/parser/test/', ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            cases += [line for line in f.read().split('\n') if line.strip()]
+
+    corpus = answers + cases + formulas
+    texts = corpus + [' '.join(rand.sample(corpus, 3)) for _ in range(200)] + [text[:rand.randrange(len(text))] for text in corpus for _ in range(10)]
+    for text in texts:
+        expected = build(text, per_character)
+        assert build(text, LatexParser.parse_text) == expected, f'{text}: trees differ from the character by character build'
+        assert build(text, AbstractParser.parse_text) == expected, f'{text}: trees of AbstractParser.parse_text differ from the character by character build'
+
+    texts = [text for text in texts if not isinstance(build(text, LatexParser.parse_text), str)]
+    cost = {}
+    for parse_text in (per_character, AbstractParser.parse_text, LatexParser.parse_text):
+        cost[parse_text] = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for text in texts:
+                build(text, parse_text)
+            cost[parse_text] = min(cost[parse_text], time.perf_counter() - start)
+    serial, runs, commands = cost.values()
+    print(f'{len(answers)} formulas from the answers under {folder}, {len(cases)} latex cases, {len(formulas)} formulas written by hand')
+    print(f'{len(texts)} formulas of {sum(map(len, texts))} characters: character by character in {serial:.3f}s, by runs in {runs:.3f}s, commands dispatched at once in {commands:.3f}s, speedup {serial / commands:.2f}x')
+
 def test_table(module=None, Rank=None, offset=0, limit=None):
     import re
     from std import MySQL
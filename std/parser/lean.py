@@ -1,4 +1,5 @@
-from std.parser.node import AbstractParser, IndentedNode, Closable, case
+from std.parser.node import AbstractParser, Node, IndentedNode, Closable, case
+from std.parser.cache import cache_build
 from std.parser.newline_skipping_comment import NewLineSkippingCommentParser
 from std.parser.token import TokenParser, Token
 from std.parser.operator import OperatorParser
@@ -221,6 +222,9 @@ def push_accessibility(self, new, accessibility):
     def __copy__(self):
         new = type(self).__new__(type(self))
         new.__dict__.update(self.__dict__)
+        for name in Node.__slots__[:-1]:
+            if hasattr(self, name):
+                setattr(new, name, getattr(self, name))
         new.parent = None
         return new
 
@@ -5878,10 +5882,10 @@ def build_debug(self, text):
         self.parse('', start_idx=start_idx + 1)
         return self.root
 
+    @cache_build
     def build(self, text):
         self.init()
-        for start_idx, token in enumerate(text):
-            self.parse(token, start_idx=start_idx)
+        self.parse_text(text)
         start_idx = len(text)
         self.parse("\n", start_idx=start_idx)
         self.parse('', start_idx=start_idx + 1)
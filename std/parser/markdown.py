@@ -1,11 +1,42 @@
 # cd ../keras && bash run.sh std.parser.markdown.test_table &
 # python std/parser/markdown.py
-import sys, traceback, regex as re
+import sys, copy, traceback, functools, regex as re
 from std.parser.node import AbstractParser, clone, IndentedNode, Closable, case
+from std.parser.cache import cache_build
 from std.parser.xml import XMLParser
 from std.parser.newline import NewLineParser
 from std import computed, binary_search
 
+@functools.cache
+def compile_regex(regex):
+    return re.compile(regex)
+
+def tail_run(text, chars):
+    '''
+    start of the trailing run of [chars] in text, ignoring a final newline that is not in chars;
+    a $-anchored match consisting of [chars] only can not start before it.
+    '''
+    stop = len(text)
+    if stop and text[-1] == '\n' and '\n' not in chars:
+        stop -= 1
+    # a reverse search anchored at stop only scans the run itself
+    return compile_regex(f'(?r)[{chars}]*').search(text, 0, stop).start()
+
+def tail_delimited(text, delimiter):
+    '''
+    start of the last run of delimiter in text, not counting the delimiters at the very end;
+    a $-anchored match of the form delimiter+ [^delimiter]* delimiter* can not start before it.
+    '''
+    stop = len(text)
+    if stop and text[-1] == '\n':
+        stop -= 1
+    while stop and text[stop - 1] == delimiter:
+        stop -= 1
+    start = text.rfind(delimiter, 0, stop)
+    while start > 0 and text[start - 1] == delimiter:
+        start -= 1
+    return max(start, 0)
+
 class Markdown(IndentedNode):
     is_MarkdownText = False
     is_MarkdownSPAN = False
@@ -16,24 +47,26 @@ class Markdown(IndentedNode):
 
     @property
     def html(self):
-        html = self.htmlFormat()
-        if args := self.args:
-            return html % tuple(arg.html for arg in args)
-        return html
+        if not self.args:
+            return self.htmlFormat()
+        return ''.join(render(self, 'html'))
 
     def htmlFormat(self):
         return self.strFormat()
 
     def __str__(self):
-        s = super().__str__()
+        if self.args:
+            return ''.join(render(self, 'str'))
+        s = self.strFormat()
         if self.is_indented():
             s = ' ' * self.indent + s
         return s
 
     @property
     def plainText(self):
-        strFormat = self.strFormat()
-        text = strFormat % tuple(arg.plainText for arg in self.args) if self.args else strFormat
+        if self.args:
+            return ''.join(render(self, 'plainText'))
+        text = self.strFormat()
         if self.is_indented():
             text = ' ' * self.indent + text
         return text
@@ -136,6 +169,57 @@ def case(self, **kwargs):
     def isspace(self):
         return False
 
+# for each format of render: the method of Markdown rendering it by default, and how a node rendering itself otherwise is rendered
+renderers = {
+    'html': (Markdown.html, lambda node: node.html),
+    'plainText': (Markdown.plainText, lambda node: node.plainText),
+    'str': (Markdown.__str__, str),
+}
+
+def render(root, format='html'):
+    '''
+    yield root.html, root.plainText or str(root), as format is 'html', 'plainText' or 'str', in chunks, walking the tree once:
+    the format string of a node is split at its %s and the chunks of its args are yielded in between, instead of each node formatting the strings of its args,
+    which copies the text of a node once per ancestor. nodes that render themselves otherwise, or whose format string holds other % directives, are rendered by their own property.
+    usage:
+        ''.join(render(tree))    # == tree.html
+    '''
+    html = format == 'html'
+    default, fallback = renderers[format]
+    # whether the nodes of a class render by default, by class
+    native = {}
+    stack = [iter((root,))]
+    while stack:
+        for node in stack[-1]:
+            if (cls := type(node)) is str:
+                yield node
+                continue
+            if (is_native := native.get(cls)) is None:
+                is_native = native[cls] = (cls.__str__ if format == 'str' else getattr(cls, format, None)) is default
+            if not is_native:
+                yield fallback(node)
+                continue
+            if html:
+                string = node.htmlFormat()
+            else:
+                if node.is_indented():
+                    yield ' ' * node.indent
+                string = node.strFormat()
+            if not (args := node.args):
+                yield string
+                continue
+            if string.count('%') != len(args) or string.count('%s') != len(args):
+                # left to % to format, or raise, as it does
+                yield string % tuple(fallback(arg) for arg in args)
+                continue
+            chunks = [None] * (2 * len(args) + 1)
+            chunks[::2] = string.split('%s')
+            chunks[1::2] = args
+            stack.append(iter(chunks))
+            break
+        else:
+            stack.pop()
+
 class MarkdownCaret(Markdown):
     @property
     def text(self):
@@ -184,9 +268,16 @@ def append(self, new):
         raise Exception(f'append is not defined {new}: {self.__class__.__name__}')
 
     def push_token(self, word, **kwargs):
-        self.text += word
+        # drop the reference held by the slot first so that += can extend the string in place instead of copying it
+        text = self._text
+        self._text = None
+        text += word
+        self._text = text
         return self
 
+    def push_text(self, text, **kwargs):
+        return self.parent.insert_text(self, text, **kwargs)
+
     def is_indented(self):
         return False
 
@@ -197,10 +288,25 @@ def htmlFormat(self):
     def strFormat(self):
         return self.text
 
+    # if True, $-anchored searches only scan the suffix of the text that a match can span, which keeps build linear;
+    # if False, the whole text is rescanned for every incoming character as a reference
+    tail_window = True
+
+    def search_tail(self, regex, chars=None, delimiter=None):
+        '''
+        equivalent to re.search(regex, self.text) for a $-anchored regex whose match consists of [chars] only,
+        or takes the form delimiter+ [^delimiter]* delimiter*
+        '''
+        text = self.text
+        if not self.tail_window:
+            return re.search(regex, text)
+        pos = tail_run(text, chars) if delimiter is None else tail_delimited(text, delimiter)
+        return compile_regex(regex).search(text, pos)
+
     def push_patten(self, cls, stop=None):
         # First condition: check for pattern at end of text
         if not re.search(cls.regex_skip, self.text):
-            if (m := re.search(cls.regex_text, self.text)) and m[1]:
+            if (m := self.search_tail(cls.regex_text, delimiter=cls.char)) and m[1]:
                 self.text = self.text[:-len(m[0])]
                 new = MarkdownText(m[1], self.indent, start_idx=self.start_idx + m.start(1))
                 new_pattern = cls(new, self.indent)
@@ -219,7 +325,7 @@ def push_patten(self, cls, stop=None):
                     return new
 
         # Default case: add char to text
-        self.text += cls.char
+        self.push_token(cls.char)
         return self
 
     def push_asterisk(self, **kwargs):
@@ -238,14 +344,14 @@ def push_dollar(self, **kwargs):
         return self.push_patten(MarkdownLatex)
 
     def try_insert_latex(self, block, **kwargs):
-        if re.search(r"(?<!\\)(\\\\)*\\$", self.text):
+        if self.search_tail(r"(?<!\\)(\\\\)*\\$", r'\\'):
             return self.parent.insert_latex(self, block, **kwargs)
 
     def push_left_bracket(self, **kwargs):
         if new := self.try_insert_latex((r'\[', r'\]'), **kwargs):
             return new
         if self.text.endswith('\\'):
-            self.text += '['
+            self.push_token('[')
             return self
         return super().push_left_bracket(**kwargs)
 
@@ -311,6 +417,10 @@ def insert_underscore(self, caret, **kwargs):
     def insert_token(self, caret, word, **kwargs):
         return caret.push_token(word, **kwargs)
 
+    def insert_text(self, caret, text, **kwargs):
+        # a run of default-case characters appended at once, the same as calling insert_token with each of them
+        return caret.push_token(text, **kwargs)
+
     def insert_right_bracket(self, caret, **kwargs):
         parent = self.parent
         while parent:
@@ -447,6 +557,10 @@ def span(self, indices):
                 return node.span(indices)
             return node
 
+    @computed
+    def span_index(self):
+        return MarkdownSpanIndex(self)
+
     def process_inner_loop(self, i, **kwargs):
         args = self.args
         if args[i].has_newline():
@@ -510,19 +624,19 @@ def insert_space(self, caret, **kwargs):
                 previousElementSibling = caret.parent.previousElementSibling
             newline = '^' if previousElementSibling and previousElementSibling.is_Paragraph else r'(?<=\n)'
             # Handle headings
-            if m := re.search(newline + MarkdownH.regex_text, caret.text):
+            if m := caret.search_tail(newline + MarkdownH.regex_text, '\n #'):
                 level = len(m[1])
                 caret.text = caret.text[:-len(m[0])]
                 if not caret.text:
                     caret.remove()
                 return self.parent.insert_h(self, level, **kwargs)
             # Handle unordered lists
-            if m := re.search(newline + '( *)([-*])$', caret.text):
+            if m := caret.search_tail(newline + '( *)([-*])$', '\n *-'):
                 return self.insert_ul(caret, m, **kwargs)
             # Handle ordered lists
-            if m := re.search(newline + r'( *)(\d+\.)$', caret.text):
+            if m := caret.search_tail(newline + r'( *)(\d+\.)$', '\n .\\d'):
                 return self.insert_ol(caret, m, **kwargs)
-            caret.text += ' '
+            caret.push_token(' ')
         else:
             caret = MarkdownText(' ', self.indent, **kwargs)
             self.push(caret)
@@ -588,7 +702,7 @@ def try_pattern(self, cls, stop=None):
         nested_pattern = []
         for i in range(len(self.args) - 2, -1, -1):
             node = self.args[i]
-            if isinstance(node, MarkdownText) and (m := re.search(cls.regex_span, node.text)):
+            if isinstance(node, MarkdownText) and (m := node.search_tail(cls.regex_span, delimiter=cls.char)):
                 node.text = node.text[:-len(m[0])]
                 new_pattern = cls(
                     MarkdownSPAN(
@@ -627,9 +741,9 @@ def insert_newline(self, caret, newline_count, indent, next, **kwargs):
         if isinstance(self.parent, (MarkdownArgsBarSeparated, MarkdownH)):
             return self.parent.insert_newline(self, newline_count, indent, next=next, **kwargs)
         if isinstance(caret, MarkdownText):
-            if m := re.search(MarkdownPreCode.code_start_regex, caret.text):
+            if m := caret.search_tail(MarkdownPreCode.code_start_regex, r'`a-zA-Z:+\d '):
                 return self.insert_code(caret, m, indent, **kwargs)
-            if m := re.search(MarkdownHR.regex, caret.text):
+            if m := caret.search_tail(MarkdownHR.regex, '\n *_-'):
                 return self.insert_hr(caret, m, **kwargs)
         if newline_count == 1:
             return self.insert_token(caret, "\n" * newline_count + ' ' * indent, **kwargs)
@@ -712,6 +826,11 @@ def insert_token(self, caret, word, **kwargs):
             return MarkdownI.push_token(caret, word, **kwargs)
         return super().insert_token(caret, word, **kwargs)
 
+    def insert_text(self, caret, text, **kwargs):
+        if isinstance(self.parent, MarkdownLI):
+            return self.parent.insert_text(caret, text, **kwargs)
+        return caret.push_token(text, **kwargs)
+
     def insert_bar(self, caret, **kwargs):
         for i in reversed(range(len(self.args))):
             if new := self.process_inner_loop(i, **kwargs):
@@ -1034,6 +1153,73 @@ def insert_left_bracket(self, caret, **kwargs):
             return self.insert_token(caret, '[', **kwargs)
         return super().insert_left_bracket(caret, **kwargs)
 
+class MarkdownSpanIndex:
+    '''
+    flattened interval index of a MarkdownArgs tree, answering span queries for many intervals at once:
+    the nodes reachable through nested MarkdownArgs are laid out breadth first, so that the children of a node are contiguous,
+    and span is replayed as a binary search run in lockstep over numpy arrays for all the queries, one level at a time.
+    '''
+    def __init__(self, root):
+        import numpy as np
+        nodes = [root]
+        first = []
+        count = []
+        for node in nodes:
+            first.append(len(nodes))
+            if isinstance(node, MarkdownArgs):
+                count.append(len(node.args))
+                nodes.extend(node.args)
+            else:
+                count.append(0)
+        self.nodes = nodes
+        self.first = np.array(first)
+        self.count = np.array(count)
+        self.is_args = np.array([isinstance(node, MarkdownArgs) for node in nodes])
+        # the root itself is never compared, so its interval is not needed
+        self.start_idx = np.array([0, *(node.start_idx for node in nodes[1:])])
+        self.end_idx = np.array([0, *(node.end_idx for node in nodes[1:])])
+
+    def span(self, start_idx, end_idx):
+        '''
+        for each interval [start_idx[i], end_idx[i]), return the position in self.nodes of the node that root.span would return,
+        or -1 where it would return None.
+        '''
+        import numpy as np
+        start_idx, end_idx = np.broadcast_arrays(np.asarray(start_idx, dtype=np.int64), np.asarray(end_idx, dtype=np.int64))
+        start_idx = start_idx.ravel()
+        end_idx = end_idx.ravel()
+        span = np.full(len(start_idx), -1)
+        # indices of the queries still descending, and the MarkdownArgs node each one is at
+        active = np.arange(len(start_idx))
+        node = np.zeros(len(start_idx), dtype=np.int64)
+        while active.size:
+            s = start_idx[active]
+            e = end_idx[active]
+            begin = self.first[node]
+            stop = begin + self.count[node]
+            end = stop.copy()
+            found = np.full(active.size, -1)
+            pending = np.flatnonzero(begin < end)
+            while pending.size:
+                mid = (begin[pending] + end[pending]) >> 1
+                before = self.end_idx[mid] <= s[pending]
+                after = ~before & (self.start_idx[mid] >= e[pending])
+                begin[pending[before]] = mid[before] + 1
+                end[pending[after]] = mid[after]
+                hit = ~(before | after)
+                found[pending[hit]] = mid[hit]
+                pending = pending[~hit]
+                pending = pending[begin[pending] < end[pending]]
+            index = np.where(found >= 0, found, begin)
+            inside = index < stop
+            index = index[inside]
+            descend = self.is_args[index] & (self.start_idx[index] < e[inside])
+            span[active[inside][~descend]] = index[~descend]
+            active = active[inside][descend]
+            node = index[descend]
+        return span
+
+
 class MarkdownArgsBarSeparated(MarkdownArgs):
     is_Paragraph = True
     def strip_head_tail(self):
@@ -1187,7 +1373,7 @@ def insert_newline(self, caret, newline_count, indent, next, **kwargs):
             if self.lang is None:
                 if indent < 4:
                     self.is_closed = True
-            elif m := re.search(r'\n* *``` *$', caret.text):
+            elif m := caret.search_tail(r'\n* *``` *$', '\n `'):
                 caret.text = caret.text[:-len(m[0])]
                 self.is_closed = True
         if self.is_closed:
@@ -1358,18 +1544,18 @@ def insert_right(self, caret, **kwargs):
     def insert_space(self, caret, **kwargs):
         if isinstance(caret, MarkdownText):
             if caret is not self.header:
-                if m := re.search(r'(?<=^|\n)' + MarkdownH.regex_text, caret.text):
+                if m := caret.search_tail(r'(?<=^|\n)' + MarkdownH.regex_text, ' #'):
                     level = len(m[1])
                     caret.text = caret.text[:-len(m[0])]
                     new = self.insert_h(caret, level, **kwargs)
                     if not caret.text:
                         caret.remove()
                     return new
-                if m := re.search(r'(?<=^|\n)( *)([-*])$', caret.text):
+                if m := caret.search_tail(r'(?<=^|\n)( *)([-*])$', ' *-'):
                     return self.insert_ul(caret, m, **kwargs)
-                if m := re.search(r'(?<=^|\n)( *)(\d+\.)$', caret.text):
+                if m := caret.search_tail(r'(?<=^|\n)( *)(\d+\.)$', r' .\d'):
                     return self.insert_ol(caret, m, **kwargs)
-            caret.text += ' '
+            caret.push_token(' ')
         return caret
 
     def insert_backtick(self, caret, **kwargs):
@@ -1393,9 +1579,9 @@ def insert_newline(self, caret, newline_count, indent, next, **kwargs):
             return caret
 
         if isinstance(caret, MarkdownText):
-            if m := re.search(MarkdownPreCode.code_start_regex, caret.text):
+            if m := caret.search_tail(MarkdownPreCode.code_start_regex, r'`a-zA-Z:+\d '):
                 return self.insert_code(caret, m, indent, **kwargs)
-            if m := re.search(MarkdownHR.regex, caret.text):
+            if m := caret.search_tail(MarkdownHR.regex, '\n *_-'):
                 return self.insert_hr(caret, m, **kwargs)
             if newline_count == 1:
                 return self.insert_token(caret, "\n" * newline_count + ' ' * indent, **kwargs)
@@ -1541,14 +1727,14 @@ def insert_left_parenthesis(self, caret, **kwargs):
         return caret.push_token('(', **kwargs)
 
     def insert_right_bracket(self, caret, **kwargs):
-        if self.block[1] == r'\]' and isinstance(caret, MarkdownText) and re.search(r'(?<!\\)(\\\\)*\\$', caret.text):
+        if self.block[1] == r'\]' and isinstance(caret, MarkdownText) and caret.search_tail(r'(?<!\\)(\\\\)*\\$', r'\\'):
             caret.text = caret.text[:-1]
             self.is_closed = True
             return self
         return caret.push_token(']', **kwargs)
 
     def insert_right_parenthesis(self, caret, **kwargs):
-        if self.block[1] == r'\)' and isinstance(caret, MarkdownText) and re.search(r'(?<!\\)(\\\\)*\\$', caret.text):
+        if self.block[1] == r'\)' and isinstance(caret, MarkdownText) and caret.search_tail(r'(?<!\\)(\\\\)*\\$', r'\\'):
             caret.text = caret.text[:-1]
             self.is_closed = True
             return self
@@ -1573,7 +1759,7 @@ def insert_quote(self, caret, quote, **kwargs):
         if isinstance(caret, MarkdownCaret) and \
             isinstance(self.parent, MarkdownSPAN) and \
             isinstance(previousElementSibling := self.previousElementSibling, MarkdownText) and \
-            re.search(fr"(?<!\\){quote}[^{quote}]*$", previousElementSibling.text):
+            previousElementSibling.search_tail(fr"(?<!\\){quote}[^{quote}]*$", delimiter=quote):
             previousElementSibling.text += str(self) + quote
             self.remove()
             return previousElementSibling
@@ -1612,7 +1798,7 @@ def strFormat(self):
 
     def insert_newline(self, caret, newline_count, indent, next, **kwargs):
         if isinstance(caret, MarkdownText):
-            if m := re.search(MarkdownPreCode.code_start_regex, caret.text):
+            if m := caret.search_tail(MarkdownPreCode.code_start_regex, r'`a-zA-Z:+\d '):
                 return self.insert_code(caret, m, indent, **kwargs)
             if isinstance(self.parent, MarkdownUL) and (m := re.match(fr'(?: *[{self.text}]){{2,}} *$', caret.text)):
                 new = MarkdownHR(self.indent, start_idx=self.start_idx)
@@ -1622,7 +1808,7 @@ def insert_newline(self, caret, newline_count, indent, next, **kwargs):
                 else:
                     self.replace(caret, new)
                 return new
-            if m := re.search(MarkdownHR.regex, caret.text):
+            if m := caret.search_tail(MarkdownHR.regex, '\n *_-'):
                 return self.insert_hr(caret, m, **kwargs)
             if newline_count > 1 and not re.search('[-*0-9]', next):
                 caret = MarkdownText(' ' * indent, 0, **kwargs) if indent else MarkdownCaret(indent, **kwargs)
@@ -1636,7 +1822,7 @@ def insert_newline(self, caret, newline_count, indent, next, **kwargs):
                 else:
                     self.push(MarkdownP([caret], indent))
             else:
-                caret.text += "\n" * newline_count + ' ' * indent
+                caret.push_token("\n" * newline_count + ' ' * indent)
         else:
             caret = MarkdownText("\n" * newline_count + ' ' * indent, indent, **kwargs)
             self.push(caret)
@@ -1682,7 +1868,7 @@ def insert_space(self, caret, **kwargs):
         if isinstance(caret, MarkdownText):
             previousElementSibling = caret.previousElementSibling
             newline = '(?<=^|\n)' if isinstance(previousElementSibling, (MarkdownPreCode, MarkdownTABLE, MarkdownP, MarkdownH, MarkdownDocument, MarkdownHR, MarkdownBR, MarkdownListBase)) else '\n'
-            if m := re.search(newline + '( *)([-*])$', caret.text):
+            if m := caret.search_tail(newline + '( *)([-*])$', '\n *-'):
                 indent = len(m[1])
                 warning = None
                 if indent == self.indent + 1 and self.indent:
@@ -1696,7 +1882,7 @@ def insert_space(self, caret, **kwargs):
                 new.warning = warning
                 return new
 
-            if m := re.search(newline + r'( *)(\d+\.)$', caret.text):
+            if m := caret.search_tail(newline + r'( *)(\d+\.)$', '\n .\\d'):
                 caret.text = caret.text[:-len(m[0])]
                 indent = len(m[1])
                 child_indent = len(m[0]) + 1
@@ -1709,11 +1895,11 @@ def insert_space(self, caret, **kwargs):
                 if not caret.text:
                     caret.remove()
                 return new
-            if caret.indent < 4 and (m := re.search(newline + MarkdownH.regex_text, caret.text)):
+            if caret.indent < 4 and (m := caret.search_tail(newline + MarkdownH.regex_text, '\n #')):
                 level = len(m[1])
                 caret.text = caret.text[:-len(m[0])]
                 return self.insert_h(caret, level, **kwargs)
-            if m := re.search(newline + MarkdownBLOCKQUOTE.regex_text, caret.text):
+            if m := caret.search_tail(newline + MarkdownBLOCKQUOTE.regex_text, '\n >'):
                 caret.text = caret.text[:-len(m[0])]
                 new = self.insert_blockquote(caret, **kwargs)
                 if not caret.text:
@@ -1739,12 +1925,12 @@ def insert_underscore(self, caret, **kwargs):
     def try_indent_li(self, caret, word, **kwargs):
         node = self
         text = caret.text
-        if re.search(r'\n\n$', text):
+        if caret.search_tail(r'\n\n$', '\n'):
             ol_match = re.match(r' *\d+\.?', word)
             ul_match = re.match(r' *[-*]', word)
             preprocess = lambda _: word
             count = sys.maxsize
-        elif m := re.search(r'\n\n( *)[-*]$', text):
+        elif m := caret.search_tail(r'\n\n( *)[-*]$', '\n *-'):
             if m[1] and len(m[1]) >= self.indent:
                 return
             ol_match = False
@@ -1753,7 +1939,7 @@ def preprocess(caret):
                 caret.text = caret.text[:-len(m[0])]
                 return m[0] + word
             count = sys.maxsize
-        elif m := re.search(r'(.*)\n( +)$', text, re.S):
+        elif m := caret.search_tail(r'\n( +)$', '\n ') and re.search(r'(.*)\n( +)$', text, re.S):
             # possibly the beginning of a new list
             if word in '-*':
                 return
@@ -1799,6 +1985,13 @@ def insert_token(self, caret, word, **kwargs):
                 return new
         return super().insert_token(caret, word, **kwargs)
 
+    def insert_text(self, caret, text, **kwargs):
+        # try_indent_li only reacts to a text ending with a newline, a space or a list marker,
+        # once a run has started none of its characters can trigger it
+        if caret.text[-1:] not in '\n -*':
+            return caret.push_token(text, **kwargs)
+        return None
+
     append = MarkdownSPAN.append
     insert_bar = MarkdownSPAN.insert_bar
     insert_backtick = MarkdownSPAN.insert_backtick
@@ -1933,7 +2126,7 @@ def strFormat(self):
 
     def insert_space(self, caret, **kwargs):
         if isinstance(caret, MarkdownText):
-            caret.text += ' '
+            caret.push_token(' ')
         else:
             caret.push_token(' ', **kwargs)
         return caret
@@ -1963,9 +2156,9 @@ def insert_newline(self, caret, newline_count, indent, next, **kwargs):
         if isinstance(self.parent, MarkdownArgsBarSeparated):
             return self.parent.insert_newline(self, newline_count, indent, next=next, **kwargs)
         if isinstance(caret, MarkdownText):
-            if m := re.search(MarkdownPreCode.code_start_regex, caret.text):
+            if m := caret.search_tail(MarkdownPreCode.code_start_regex, r'`a-zA-Z:+\d '):
                 return self.insert_code(caret, m, indent, **kwargs)
-            if m := re.search(MarkdownHR.regex, caret.text):
+            if m := caret.search_tail(MarkdownHR.regex, '\n *_-'):
                 return self.insert_hr(caret, m, **kwargs)
         if newline_count == 1 or isinstance(self.parent, MarkdownLI):
             return self.insert_token(caret, "\n" * newline_count + ' ' * indent, **kwargs)
@@ -2188,22 +2381,21 @@ def strFormat(self):
 
     def insert_space(self, caret, **kwargs):
         if isinstance(caret, MarkdownText):
-            text = caret.text
-            if m := re.search(r'(?<=^|\n)' + MarkdownH.regex_text, text):
+            if m := caret.search_tail(r'(?<=^|\n)' + MarkdownH.regex_text, ' #'):
                 level = len(m[1])
-                caret.text = text[:-len(m[0])]
+                caret.text = caret.text[:-len(m[0])]
                 new = self.insert_h(caret, level, **kwargs)
                 if not caret.text:
                     caret.remove()
                 return new
 
-            if m := re.search(r'(?<=^|\n)( *)([-*])$', text):
+            if m := caret.search_tail(r'(?<=^|\n)( *)([-*])$', ' *-'):
                 return self.insert_ul(caret, m, **kwargs)
 
-            if m := re.search(r'(?<=^|\n)( *)(\d+\.)$', text):
+            if m := caret.search_tail(r'(?<=^|\n)( *)(\d+\.)$', r' .\d'):
                 return self.insert_ol(caret, m, **kwargs)
 
-            caret.text += ' '
+            caret.push_token(' ')
             return caret
         else:
             new = MarkdownText(' ', self.indent, **kwargs)
@@ -2219,9 +2411,9 @@ def root(self):
 
     def insert_newline(self, caret, newline_count, indent, next, **kwargs):
         if isinstance(caret, MarkdownText):
-            if m := re.search(MarkdownPreCode.code_start_regex, caret.text):
+            if m := caret.search_tail(MarkdownPreCode.code_start_regex, r'`a-zA-Z:+\d '):
                 return self.insert_code(caret, m, indent, **kwargs)
-            if m := re.search(MarkdownHR.regex, caret.text):
+            if m := caret.search_tail(MarkdownHR.regex, '\n *_-'):
                 return self.insert_hr(caret, m, **kwargs)
 
         if newline_count > 1:
@@ -2280,12 +2472,14 @@ def insert_bar(self, caret, **kwargs):
 
 class MarkdownParser(AbstractParser):
     def __init__(self):
-        ...
+        # start_idx of the next chunk to feed, None if no session is open
+        self.start_idx = None
 
     def init(self):
         caret = MarkdownCaret(start_idx=0)
         self.caret = caret
         self.root = MarkdownDocument([caret], 0)
+        self.start_idx = 0
 
     def __str__(self):
         return str(self.root)
@@ -2314,17 +2508,46 @@ def build_debug(self, text):
         self.parse('', start_idx=start_idx + 1)
         return self.root
 
-    def build(self, text, warning=[]):
-        self.init()
-        for start_idx, token in enumerate(text):
-            caret = self.parse(token, start_idx=start_idx)
-            if w := caret.warning:
-                warning.append(w)
-        start_idx = len(text)
+    def feed(self, chunk, warning=None):
+        '''
+        parse the next chunk of a streamed text into the tree built so far, at a cost proportional to the chunk;
+        a new session is opened if there is none.
+        '''
+        if self.start_idx is None:
+            self.init()
+        self.parse_text(chunk, start_idx=self.start_idx, warning=warning)
+        self.start_idx += len(chunk)
+        return self.caret
+
+    def snapshot(self):
+        '''
+        return the tree of the text fed so far, as build would, leaving the session open for further chunks
+        '''
+        if self.start_idx is None:
+            self.init()
+        parser = MarkdownParser()
+        parser.root, parser.caret = copy.deepcopy((self.root, self.caret))
+        parser.start_idx = self.start_idx
+        return parser.finish()
+
+    def finish(self):
+        '''
+        close the session and return the tree of the text fed so far
+        '''
+        if self.start_idx is None:
+            self.init()
+        start_idx = self.start_idx
         self.parse("\n", start_idx=start_idx)
         self.parse('', start_idx=start_idx + 1)
+        self.start_idx = None
         return self.root
 
+    @cache_build
+    def build(self, text, warning=None):
+        self.init()
+        self.feed(text, warning)
+        return self.finish()
+
 def test():
     text = '''\
 #### **在制药工业中的潜在应用**
@@ -2404,6 +2627,275 @@ def test_table(id=None, Rank=None, offset=0):
                 print(e)
                 return
 
+def test_linear(sizes=(5000, 10000, 20000, 40000)):
+    '''
+    build long single-paragraph and list documents with and without MarkdownText.tail_window,
+    check that both modes yield the same tree, and print the cost per character, which should stay flat as the size grows.
+    '''
+    import time
+    units = {
+        'paragraph': 'The quick brown fox jumps over the lazy dog, 快速的棕色狐狸跳过了懒狗。\n',
+        'list': '1. **Item**: ' + 'word ' * 10 + '\n   ' + ('continued text of the item with spaces. ' * 5 + '\n   ') * 2,
+    }
+    tail_window = MarkdownText.tail_window
+    try:
+        for name, unit in units.items():
+            for size in sizes:
+                text = (unit * (size // len(unit) + 1))[:size]
+                trees = []
+                cost = []
+                for MarkdownText.tail_window in (True, False):
+                    start = time.perf_counter()
+                    root = MarkdownParser().build(text)
+                    cost.append(time.perf_counter() - start)
+                    trees.append((str(root), root.html))
+                assert trees[0] == trees[1], f'{name} of size {size} differs between tail window and full scan'
+                print(f'{name:<10}{size:>8} chars: tail window {cost[0]:.3f}s ({cost[0] / size * 1e6:.1f} µs/char), full scan {cost[1]:.3f}s ({cost[1] / size * 1e6:.1f} µs/char)')
+    finally:
+        MarkdownText.tail_window = tail_window
+
+def test_parse_text(folder='std/src/hash/test/'):
+    '''
+    build the markdown files under folder run by run (as build does via parse_text) and character by character,
+    check that both yield the same tree and warnings, and print the time spent by each.
+    '''
+    import time
+    from std import listdir
+
+    def build_by_character(self, text, warning):
+        self.init()
+        for start_idx, token in enumerate(text):
+            caret = self.parse(token, start_idx=start_idx)
+            if w := caret.warning:
+                warning.append(w)
+        start_idx = len(text)
+        self.parse("\n", start_idx=start_idx)
+        self.parse('', start_idx=start_idx + 1)
+        return self.root
+
+    cost = [0, 0]
+    size = 0
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            text = f.read()
+        trees = []
+        for i, build in enumerate((MarkdownParser.build, build_by_character)):
+            warning = []
+            start = time.perf_counter()
+            try:
+                root = build(MarkdownParser(), text, warning)
+            except Exception as e:
+                trees.append(repr(e))
+                continue
+            cost[i] += time.perf_counter() - start
+            trees.append((str(root), root.html, warning))
+        assert trees[0] == trees[1], f'{file}: parse_text differs from parsing character by character'
+        if isinstance(trees[0], tuple):
+            size += len(text)
+    print(f'{size} chars: run by run {cost[0]:.3f}s, character by character {cost[1]:.3f}s, speedup {cost[1] / cost[0]:.2f}x')
+
+def test_feed(folder='std/src/hash/test/', snapshots=8, seed=0):
+    '''
+    stream the markdown files under folder in random chunks of 1 to 8 characters, as tokens come from a model,
+    check that finish yields the same tree and warnings as build on the whole text,
+    and that snapshot yields the same tree as build on the text fed so far.
+    '''
+    import time, random
+    from std import listdir
+    rand = random.Random(seed)
+    cost = [0, 0]
+    chunks = rebuilds = 0
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            text = f.read()
+        try:
+            warning = []
+            root = MarkdownParser().build(text, warning)
+        except Exception:
+            continue
+
+        cuts = set(rand.sample(range(len(text)), min(snapshots, len(text))))
+        self = MarkdownParser()
+        streamed = []
+        i = 0
+        while i < len(text):
+            chunk = text[i:i + rand.randint(1, 8)]
+            start = time.perf_counter()
+            self.feed(chunk, streamed)
+            cost[0] += time.perf_counter() - start
+            chunks += 1
+            i += len(chunk)
+            if cuts.intersection(range(i - len(chunk), i)):
+                start = time.perf_counter()
+                prefix = MarkdownParser().build(text[:i], [])
+                cost[1] += time.perf_counter() - start
+                rebuilds += 1
+                snapshot = self.snapshot()
+                assert (str(snapshot), snapshot.html) == (str(prefix), prefix.html), f'{file}: snapshot at {i} differs from build'
+        tree = self.finish()
+        assert (str(tree), tree.html, streamed) == (str(root), root.html, warning), f'{file}: streamed tree differs from build'
+    print(f'{chunks} chunks: {cost[0] / chunks * 1e6:.1f}us per chunk fed, {cost[1] * 1e3 / rebuilds:.1f}ms per rebuild of the text fed so far')
+
+def test_build_many(folder='std/src/hash/test/', repeat=20, workers=None):
+    '''
+    build the markdown files under folder repeat times with MarkdownParser.build_many,
+    check that the results, compact or not, streamed or not, match the serial builds, and print the time spent by each.
+    '''
+    import time
+    from std import listdir
+
+    def signature(tree):
+        # the func and offsets of the nodes, which the compact views keep
+        if isinstance(tree, str):
+            return tree
+        nodes = []
+        for node in tree.dfs():
+            try:
+                nodes.append((node.func, node.start_idx, node.end_idx))
+            except Exception:
+                nodes.append((node.func, -1, -1))
+        return nodes
+
+    texts = []
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+    texts *= repeat
+
+    start = time.perf_counter()
+    serial = []
+    for text in texts:
+        try:
+            serial.append(MarkdownParser.instance.build(text))
+        except Exception as e:
+            serial.append(repr(e))
+    cost = [time.perf_counter() - start]
+
+    start = time.perf_counter()
+    trees = MarkdownParser.build_many(texts, workers=workers, chunksize=16)
+    cost.append(time.perf_counter() - start)
+    for i, tree in enumerate(trees):
+        assert signature(tree) == signature(serial[i]), f'compact tree {i} differs from the serial build'
+        if not isinstance(tree, str):
+            assert tree.tree.text == texts[i], f'compact tree {i} does not keep its text'
+
+    serial = [tree if isinstance(tree, str) else tree.toJSON() for tree in serial]
+    start = time.perf_counter()
+    for i, tree in enumerate(MarkdownParser.build_many(iter(texts), workers=workers, chunksize=16, compact=False, stream=True)):
+        assert (tree if isinstance(tree, str) else tree.toJSON()) == serial[i], f'streamed tree {i} differs from the serial build'
+    cost.append(time.perf_counter() - start)
+    print(f'{len(texts)} texts: serial {cost[0]:.3f}s, build_many {cost[1]:.3f}s, streamed {cost[2]:.3f}s')
+
+def test_span_index(folder='std/src/hash/test/', queries=2000, seed=0):
+    '''
+    query random intervals of the markdown files under folder with span and with span_index,
+    check that both return the same nodes, and print the time spent by each.
+    '''
+    import time, random
+    from std import listdir, Object
+    rand = random.Random(seed)
+    cost = [0, 0]
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            text = f.read()
+        try:
+            root = MarkdownParser().build(text)
+        except Exception:
+            continue
+        start_idx = [rand.randrange(len(text)) for _ in range(queries)]
+        end_idx = [start + rand.randint(0, 64) for start in start_idx]
+
+        start = time.perf_counter()
+        spans = [root.span(Object(start_idx=s, end_idx=e)) for s, e in zip(start_idx, end_idx)]
+        cost[0] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        span_index = MarkdownSpanIndex(root)
+        indices = span_index.span(start_idx, end_idx)
+        cost[1] += time.perf_counter() - start
+
+        nodes = span_index.nodes
+        assert all(span is (nodes[i] if i >= 0 else None) for span, i in zip(spans, indices.tolist())), f'{file}: span_index differs from span'
+    print(f'span {cost[0]:.3f}s, span_index (including its construction) {cost[1]:.3f}s, speedup {cost[0] / cost[1]:.2f}x')
+
+def test_threads(folder='std/src/hash/test/', repeat=100, max_workers=16):
+    '''
+    build the markdown files under folder repeat times with MarkdownParser.instance from concurrent threads,
+    check that every tree and warning list equals the one built serially.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    from std import listdir
+
+    def build(text):
+        warning = []
+        try:
+            root = MarkdownParser.instance.build(text, warning)
+        except Exception as e:
+            return repr(e)
+        return str(root), root.html, warning
+
+    texts = []
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+    serial = [build(text) for text in texts]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for i, tree in enumerate(executor.map(build, texts * repeat)):
+            assert tree == serial[i % len(texts)], f'tree {i} built in a thread differs from the serial build'
+    print(f'{len(texts) * repeat} trees built by {max_workers} threads, all equal to the serial builds')
+
+def test_render(folder='std/src/hash/test/', depths=(100, 300, 1000)):
+    '''
+    render the markdown files under folder and lists nested depths deep by render and by the recursive % formatting of each node,
+    check that both give the same html, plainText and str, and print the time spent by each.
+    '''
+    import time
+    from std import listdir
+
+    def formatted(node, format):
+        # the html, plainText or str of node by formatting the strings of its args, as Markdown rendered them before render
+        default, fallback = renderers[format]
+        if (type(node).__str__ if format == 'str' else getattr(type(node), format, None)) is not default:
+            return fallback(node)
+        string = node.htmlFormat() if format == 'html' else node.strFormat()
+        if node.args:
+            string %= tuple(formatted(arg, format) for arg in node.args)
+        if format != 'html' and node.is_indented():
+            string = ' ' * node.indent + string
+        return string
+
+    documents = {}
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            documents.setdefault(folder, []).append(f.read())
+    for depth in depths:
+        documents[f'lists nested {depth} deep'] = ['\n'.join('  ' * i + f'- item {i} with **bold** and `code` text' for i in range(depth))]
+
+    limit = sys.getrecursionlimit()
+    # deep enough for the recursive formatting, and for building the nested lists
+    sys.setrecursionlimit(max(limit, 20 * max(depths)))
+    try:
+        for name, texts in documents.items():
+            trees = []
+            for text in texts:
+                try:
+                    trees.append(MarkdownParser().build(text))
+                except Exception:
+                    ...
+            cost = [0, 0]
+            for format in renderers:
+                for tree in trees:
+                    start = time.perf_counter()
+                    expected = formatted(tree, format)
+                    cost[0] += time.perf_counter() - start
+                    start = time.perf_counter()
+                    result = ''.join(render(tree, format))
+                    cost[1] += time.perf_counter() - start
+                    assert result == expected, f'{name}: {format} differs between render and the recursive formatting'
+            print(f'{name}: recursive formatting in {cost[0]:.4f}s, render in {cost[1]:.4f}s')
+    finally:
+        sys.setrecursionlimit(limit)
+
 # convert $$...$$ block latex to \[...\] block latex to facilitate parsing
 def convert_block_latex(latex):
     return re.sub(r'\$\$([\s\S]+?)\$\$', r'\[\1\]', latex)
@@ -20,7 +20,7 @@ def case(self, **_):
     @case
     def case(self, **kwargs):
         caret = self.parent
-        self_kwargs = self.kwargs
+        self_kwargs = self.kwargs_dict
         if self.next:
             self_kwargs['next'] = self.key
         return caret.parent.insert_newline(caret, self.newline_count, **self_kwargs).parse(self.key, **kwargs)
@@ -21,7 +21,7 @@ def case(self, **_):
     def case(self, **kwargs):
         key = self.key
         caret = self.parent
-        self_kwargs = self.kwargs
+        self_kwargs = self.kwargs_dict
         if self.next:
             self_kwargs['next'] = key
         if self.hyphen_count:
@@ -1,3 +1,4 @@
+import os, itertools, threading, regex as re
 from std import computed, array_splice
 from collections import deque
 
@@ -36,35 +37,68 @@ def base(cls):
     #     return cls
 
 class Node(metaclass=Dispatcher):
-    def __init__(self, **kwargs):
-        parent = kwargs.pop('parent', None)
-        self.kwargs = kwargs
+    # the attributes common to most nodes are slotted, any other keyword argument goes to kwargs, a dict created on demand;
+    # __dict__ is only allocated for the nodes that need it, to cache computed properties or hold attributes set by subclasses
+    __slots__ = ('parent', 'args', 'key', '_indent', '_text', '_start_idx', '_warning', '_kwargs', '__dict__')
+
+    def __init__(self, parent=None, **kwargs):
         self.parent = parent
         self.args = []
+        if 'indent' in kwargs:
+            self._indent = kwargs.pop('indent')
+        if 'text' in kwargs:
+            self._text = kwargs.pop('text')
+        if 'start_idx' in kwargs:
+            self._start_idx = kwargs.pop('start_idx')
+        self._warning = kwargs.pop('warning', None)
+        if kwargs:
+            self._kwargs = kwargs
+
+    @property
+    def kwargs(self):
+        try:
+            return self._kwargs
+        except AttributeError:
+            self._kwargs = kwargs = {}
+            return kwargs
+
+    @property
+    def kwargs_dict(self):
+        # a new dict of all the keyword arguments of the node, slotted or not, to be passed on as **kwargs
+        kwargs = {}
+        for name in ('indent', 'text', 'start_idx'):
+            try:
+                kwargs[name] = getattr(self, '_' + name)
+            except AttributeError:
+                ...
+        if (warning := self._warning) is not None:
+            kwargs['warning'] = warning
+        kwargs.update(self.kwargs)
+        return kwargs
 
     @property
     def indent(self):
-        return self.kwargs['indent']
+        return self._indent
 
     @indent.setter
     def indent(self, indent):
-        self.kwargs['indent'] = indent
+        self._indent = indent
 
     @property
     def text(self):
-        return self.kwargs['text']
+        return self._text
 
     @text.setter
     def text(self, text):
-        self.kwargs['text'] = text
+        self._text = text
 
     @property
     def start_idx(self):
-        return self.kwargs['start_idx']
+        return self._start_idx
 
     @start_idx.setter
     def start_idx(self, start_idx):
-        self.kwargs['start_idx'] = start_idx
+        self._start_idx = start_idx
 
     @property
     def end_idx(self):
@@ -76,11 +110,11 @@ def kwargs_list(self):
 
     @property
     def warning(self):
-        return self.kwargs.get('warning')
+        return self._warning
 
     @warning.setter
     def warning(self, warning):
-        self.kwargs['warning'] = warning
+        self._warning = warning
 
     def clone(self):
         return self.__class__(*self.kwargs_list, self.indent)
@@ -165,55 +199,71 @@ def compareTo(self, index):
     def parse(self, text, *args, **kwargs):
         return self.case[text](self, *args, **kwargs)
 
-    def dfs_preorder(self):
-        yield self
-        for arg in self.args:
-            yield from arg.dfs_preorder()
+    # push_text(self, text, **kwargs) takes a run of inert characters in one call, with the same effect as parsing them one by one;
+    # it returns the new caret, or None if the run has to be parsed character by character.
+    # it usually defers to parent.insert_text(caret, text, **kwargs), whose overrides end with an explicit return None for the runs they cannot take at once,
+    # so that the fallback is never left to a body falling off its end.
+    # node types without a bulk path leave it as None
+    push_text = None
+
+    @property
+    def inert(self):
+        # regex matching the run of characters handed over to push_text, by default those falling into the default case
+        return self.case.inert
 
-    def dfs_preorder_reversed(self):
-        yield self
-        for arg in reversed(self.args):
-            yield from arg.dfs_preorder_reversed()
+    # the traversals below keep an explicit stack of iterators over the args of the nodes on the current path instead of nesting generators,
+    # so that each step costs O(1) whatever the depth, and deep trees do not hit the recursion limit.
+    # types: only the nodes that are instances of types are yielded, all nodes being traversed;
+    # prune: a callable, the nodes for which it returns True are skipped together with their subtrees.
+    def dfs_preorder(self, types=None, prune=None):
+        return dfs_preorder(self, iter, types, prune)
 
-    def dfs_postorder(self):
-        for arg in self.args:
-            yield from arg.dfs_postorder()
-        yield self
+    def dfs_preorder_reversed(self, types=None, prune=None):
+        return dfs_preorder(self, reversed, types, prune)
 
-    def dfs_postorder_reversed(self):
-        for arg in reversed(self.args):
-            yield from arg.dfs_postorder_reversed()
-        yield self
+    def dfs_postorder(self, types=None, prune=None):
+        return dfs_postorder(self, iter, types, prune)
+
+    def dfs_postorder_reversed(self, types=None, prune=None):
+        return dfs_postorder(self, reversed, types, prune)
 
     def dfs(self, **kwargs):
         preorder = kwargs.get('preorder', None)
         if preorder is None:
             preorder = not kwargs['postorder'] if 'postorder' in kwargs else True
+        types = kwargs.get('types')
+        prune = kwargs.get('prune')
 
         if kwargs.get('reverse', None):
             if preorder:
-                yield from self.dfs_preorder_reversed()
+                return self.dfs_preorder_reversed(types, prune)
             else:
-                yield from self.dfs_postorder_reversed()
+                return self.dfs_postorder_reversed(types, prune)
         else:
             if preorder:
-                yield from self.dfs_preorder()
+                return self.dfs_preorder(types, prune)
             else:
-                yield from self.dfs_postorder()
+                return self.dfs_postorder(types, prune)
 
     def bfs(self, **kwargs):
         preorder = kwargs.get('preorder', None)
         if preorder is None:
             preorder = not kwargs['postorder'] if 'postorder' in kwargs else True
         reverse = kwargs.get('reverse', False)
+        types = kwargs.get('types')
+        prune = kwargs.get('prune')
+        if prune and prune(self):
+            return
         queue = deque([self])
         if preorder:
             # Top-down BFS
             while queue:
                 node = queue.popleft()
-                yield node
+                if types is None or isinstance(node, types):
+                    yield node
                 # Add children in normal/reversed order
-                queue.extend(reversed(node.args) if reverse else node.args)
+                args = reversed(node.args) if reverse else node.args
+                queue.extend(args if prune is None else (arg for arg in args if not prune(arg)))
         else:
             # Bottom-up BFS: collect levels then reverse
             levels = []
@@ -223,11 +273,15 @@ def bfs(self, **kwargs):
                 for _ in range(level_size):
                     node = queue.popleft()
                     current_level.append(node)
-                    queue.extend(reversed(node.args) if reverse else node.args)
+                    args = reversed(node.args) if reverse else node.args
+                    queue.extend(args if prune is None else (arg for arg in args if not prune(arg)))
                 levels.append(current_level)
             # Yield levels bottom-up
             for level in reversed(levels):
-                yield from level
+                if types is None:
+                    yield from level
+                else:
+                    yield from (node for node in level if isinstance(node, types))
 
     def finditer(self, pred, **kwargs):
         for node in self.dfs(**kwargs):
@@ -339,9 +393,22 @@ def adjustment(self, index, node=None):
         ...
 
 class AbstractParser(type):
-    @computed
+    def __init__(cls, name, bases, __dict__):
+        super().__init__(name, bases, __dict__)
+        cls.local = threading.local()
+
+    @property
     def instance(cls):
-        return cls()
+        '''
+        a parser holds the mutable caret / root of the tree being built, so each thread gets an instance of its own:
+        threads can call cls.instance.build concurrently without corrupting each other's trees.
+        '''
+        local = cls.local
+        try:
+            return local.instance
+        except AttributeError:
+            local.instance = instance = cls()
+            return instance
 
 
 class AbstractParser(metaclass=AbstractParser):
@@ -353,6 +420,57 @@ def parse(self, text, **kwargs):
         self.caret = self.caret.parse(text, **kwargs)
         return self.caret
 
+    push_text = None
+
+    # a std.parser.cache.ParseCache consulted by the builds decorated with cache_build, None for no caching
+    cache = None
+
+    def parse_text(self, text, start_idx=0, warning=None, on_error=None):
+        '''
+        parse text run by run instead of character by character:
+        a run of characters inert to the caret is handed over to caret.push_text in a single call,
+        any other character goes through parse as usual.
+        warning collects the warning of the caret after each character, as a character-by-character loop would.
+        on_error, if given, is called with the exception raised by a character, which is then skipped and the parse goes on, instead of the exception being raised.
+        '''
+        i = 0
+        size = len(text)
+        while i < size:
+            caret = self.caret
+            try:
+                if caret.push_text and (stop := caret.inert.match(text, i).end()) - i > 1 and \
+                    (new := caret.push_text(text[i:stop], start_idx=start_idx + i)):
+                    self.caret = caret = new
+                    count = stop - i
+                    i = stop
+                else:
+                    caret = self.parse(text[i], start_idx=start_idx + i)
+                    count = 1
+                    i += 1
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(e)
+                caret = self.caret
+                count = 1
+                i += 1
+            if warning is not None and (w := caret.warning):
+                warning.extend([w] * count)
+        return self.caret
+
+    @classmethod
+    def build_many(cls, texts, workers=None, chunksize=64, compact=True, stream=False):
+        '''
+        build the texts in a pool of worker processes, each with its own cls.instance, fed chunksize texts at a time.
+        with compact=True a tree is sent back encoded by columnar.dumps, which is far cheaper to pickle than the Node tree, and returned as the read-only view of columnar.loads,
+        with the func, offsets, text and traversals of its nodes but none of their other attributes; compact=False returns the Node trees themselves.
+        a text that fails to parse yields the repr of the exception raised in place of its tree, exceptions not being picklable in general.
+        with stream=True, texts are consumed lazily and results are yielded in the order of texts as soon as they are ready,
+        keeping at most 2 * workers chunks in flight, so that an arbitrarily long stream of texts can be processed.
+        '''
+        results = build_stream(cls, texts, workers or os.cpu_count(), chunksize, compact)
+        return results if stream else [*results]
+
     def dfs(self):
         yield self.root
 
@@ -368,6 +486,84 @@ def is_closed(self, is_closed):
         self.kwargs['is_closed'] = is_closed
 
 
+def dfs_preorder(node, order, types, prune):
+    # order is iter or reversed, applied to the args of each node
+    if prune and prune(node):
+        return
+    if types is None or isinstance(node, types):
+        yield node
+    stack = [order(node.args)]
+    while stack:
+        for arg in stack[-1]:
+            if prune and prune(arg):
+                continue
+            try:
+                args = arg.args
+            except AttributeError:
+                # a node without args, such as a parser embedded in the tree, is traversed by its own dfs
+                yield from (node for node in arg.dfs() if types is None or isinstance(node, types))
+                continue
+            if types is None or isinstance(arg, types):
+                yield arg
+            stack.append(order(args))
+            break
+        else:
+            stack.pop()
+
+def dfs_postorder(node, order, types, prune):
+    if prune and prune(node):
+        return
+    stack = [(node, order(node.args))]
+    while stack:
+        node, args = stack[-1]
+        for arg in args:
+            if prune and prune(arg):
+                continue
+            try:
+                stack.append((arg, order(arg.args)))
+            except AttributeError:
+                yield from (node for node in arg.dfs() if types is None or isinstance(node, types))
+                continue
+            break
+        else:
+            stack.pop()
+            if types is None or isinstance(node, types):
+                yield node
+
+def build_init(cls):
+    # warm up the instance of the worker process once, before any chunk of texts is sent
+    cls.instance
+
+def build_chunk(cls, texts, compact):
+    from std.parser import columnar
+    trees = []
+    for text in texts:
+        try:
+            tree = cls.instance.build(text)
+            if compact:
+                tree = columnar.dumps(tree, text)
+        except Exception as e:
+            tree = repr(e)
+        trees.append(tree)
+    return trees
+
+def build_stream(cls, texts, workers, chunksize, compact):
+    from multiprocessing import Pool
+    texts = iter(texts)
+    with Pool(processes=workers, initializer=build_init, initargs=(cls,)) as pool:
+        pending = deque()
+        while chunk := [*itertools.islice(texts, chunksize)]:
+            pending.append(pool.apply_async(build_chunk, (cls, chunk, compact)))
+            if len(pending) >= 2 * workers:
+                yield from build_views(pending.popleft().get(), compact)
+        while pending:
+            yield from build_views(pending.popleft().get(), compact)
+
+def build_views(trees, compact):
+    from std.parser import columnar
+    for tree in trees:
+        yield columnar.loads(tree) if compact and isinstance(tree, bytes) else tree
+
 class Dispatcher:
     def __init__(self):
         self.map = {}
@@ -379,7 +575,7 @@ def assign(self, pair):
             else:
                 def func(key):
                     def func(self, *args, **kwargs):
-                        self.__dict__['key'] = key
+                        self.key = key
                         return pair.func(self, *args, **kwargs)
                     return func
                 for key in key:
@@ -392,6 +588,13 @@ def __getitem__(self, key):
             return self.map[key]
         else:
             return self.default(key)
+
+    @computed
+    def inert(self):
+        # matches a (possibly empty) run of characters that all fall into the default case
+        if keys := ''.join(re.escape(key) for key in self.map if len(key) == 1):
+            return re.compile('[^%s]*' % keys)
+        return re.compile('.*', re.S)
         
     def __call__(self, *args):
         return case(*args)
@@ -405,7 +608,7 @@ def case(func):
     else:
         def case(key):
             def func(self, *args, **kwargs):
-                self.__dict__['key'] = key
+                self.key = key
                 return arg(self, *args, **kwargs)
             return func
         case.__name__ = arg.__name__
@@ -415,3 +618,120 @@ def func(self, *args, **kwargs):
 class IndentedNode(Node):
     def __init__(self, indent=0, parent=None, **kwargs):
         super().__init__(indent=indent, parent=parent, **kwargs)
+
+def test_dfs(depth=100000, breadth=100000):
+    '''
+    walk a chain of depth nodes, deeper than the recursion limit, and a tree of breadth leaves in every dfs and bfs order,
+    check the number of nodes visited, the filtering by types and the pruning, and print the time spent per node.
+    '''
+    import time
+
+    class Leaf(Node):
+        ...
+
+    def chain(depth):
+        root = node = Node()
+        for _ in range(depth - 1):
+            node.args = [Node(parent=node)]
+            node = node.args[0]
+        node.args = [Leaf(parent=node)]
+        return root
+
+    root = Node()
+    root.args = [Node(parent=root) for _ in range(breadth // 100)]
+    for node in root.args:
+        node.args = [Leaf(parent=node) for _ in range(100)]
+
+    for tree, size, leaves in ((chain(depth), depth + 1, 1), (root, 1 + breadth // 100 + breadth, breadth)):
+        for kwargs in ({}, {'reverse': True}, {'postorder': True}, {'postorder': True, 'reverse': True}):
+            for traverse in (tree.dfs, tree.bfs):
+                start = time.perf_counter()
+                count = sum(1 for _ in traverse(**kwargs))
+                cost = time.perf_counter() - start
+                assert count == size, f'{traverse.__name__}({kwargs}) visited {count} nodes instead of {size}'
+                assert sum(1 for _ in traverse(types=Leaf, **kwargs)) == leaves
+                assert sum(1 for _ in traverse(prune=lambda node: isinstance(node, Leaf), **kwargs)) == size - leaves
+                print(f'{traverse.__name__}({kwargs}): {size} nodes, {cost / size * 1e9:.0f}ns per node')
+
+def test_memory():
+    '''
+    print the bytes allocated per node of the trees built from std/parser/test (latex) and std/src/hash/test (markdown),
+    that is the memory traced while building the trees and keeping them alive, divided by the number of nodes.
+    then copy the same trees once into slotted Node instances and once into DictNode instances, the layout of Node
+    before __slots__, both copies sharing the texts of the trees, and assert the slotted copy takes less memory.
+    '''
+    import gc, tracemalloc
+    from std import listdir
+    from std.parser.latex import LatexParser
+    from std.parser.markdown import MarkdownParser
+
+    class DictNode:
+        # every node carries a __dict__ holding parent, args and a dict of all its keyword arguments
+        def __init__(self, parent=None, **kwargs):
+            self.kwargs = kwargs
+            self.parent = parent
+            self.args = []
+
+    def copy(tree, cls):
+        # the nodes of tree copied into instances of cls, the values of their keyword arguments shared with tree
+        root = cls(**tree.kwargs_dict)
+        stack = [(tree, root)]
+        while stack:
+            node, clone = stack.pop()
+            if (key := getattr(node, 'key', None)) is not None:
+                clone.key = key
+            for arg in node.args:
+                if isinstance(arg, Node):
+                    child = cls(parent=clone, **arg.kwargs_dict)
+                    stack.append((arg, child))
+                else:
+                    child = arg
+                clone.args.append(child)
+        return root
+
+    def traced(build):
+        gc.collect()
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        result = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0] - start
+        tracemalloc.stop()
+        return result, size
+
+    def count(tree):
+        count = 0
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(arg for arg in node.args if isinstance(arg, (Node, DictNode)))
+        return count
+
+    for Parser, folder in ((LatexParser, 'std/parser/test/'), (MarkdownParser, 'std/src/hash/test/')):
+        texts = []
+        for file in sorted(listdir(folder)):
+            with open(file, 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+
+        def build():
+            trees = []
+            for text in texts:
+                try:
+                    trees.append(Parser().build(text))
+                except Exception:
+                    ...
+            return trees
+
+        trees, size = traced(build)
+        nodes = sum(1 for tree in trees for _ in tree.dfs_preorder())
+        print(f'{Parser.__name__}: {nodes} nodes in {len(trees)} trees, {size / nodes:.1f} bytes per node')
+
+        sizes = {}
+        for cls in (Node, DictNode):
+            copies, sizes[cls] = traced(lambda: [copy(tree, cls) for tree in trees])
+            nodes = sum(count(tree) for tree in copies)
+            sizes[cls] /= nodes
+            del copies
+            print(f'{Parser.__name__}: {nodes} nodes copied into {cls.__name__}, {sizes[cls]:.1f} bytes per node')
+        assert sizes[Node] < sizes[DictNode], f'{Parser.__name__}: slotted nodes take {sizes[Node]:.1f} bytes, unslotted nodes {sizes[DictNode]:.1f} bytes'
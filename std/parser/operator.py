@@ -56,11 +56,11 @@ def case(self, **kwargs):
         if text in self.operators:
             self.text = text
             return self
-        return self.parent.parse('&' + self.operators[self.text], **self.kwargs).parse(self.key, **kwargs)
+        return self.parent.parse('&' + self.operators[self.text], **self.kwargs_dict).parse(self.key, **kwargs)
 
     @case
     def case(self, **kwargs):
-        return self.parent.parse('&' + self.operators[self.text], **self.kwargs).parse(self.key, **kwargs)
+        return self.parent.parse('&' + self.operators[self.text], **self.kwargs_dict).parse(self.key, **kwargs)
     
     def strFormat(self):
         return self.text
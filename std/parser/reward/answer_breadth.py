@@ -1,5 +1,6 @@
+import functools
 import regex as re
-from std.parser.reward.answer_depth import preprocess
+from std.parser.reward.answer_depth import preprocess, tree_of, AnswerDepth, LI, OL, UL, H
 from std.parser.markdown import *
 from std.parser.xml import XML
 from std import __set__
@@ -7,54 +8,99 @@
 def is_conclusion(text):
     return re.match('总结|结论|Conclusion', text)
 
-@__set__(Markdown, XMLParser, XML)
+@__set__(XMLParser, XML)
 @computed
 def answer_breadth(self):
     return 1
 
-@__set__(MarkdownOL, MarkdownUL)
-@computed
+@__set__(Markdown)
+@property
 def answer_breadth(self):
-    li = [arg for arg in self.args if isinstance(arg, MarkdownLI)]
-    return len(li)
+    # read from the metrics of the whole tree, see AnswerBreadth
+    return AnswerBreadth.of(tree_of(self)).answer_breadth(self)
 
-@__set__(MarkdownH, MarkdownDocument)
-@computed
-def answer_breadth(self):
-    ol = []
-    ul = []
-    h = []
-    for i, child in enumerate(self.args):
-        if isinstance(child, MarkdownOL):
-            if len([child for child in child.args if isinstance(child, MarkdownLI)]) > 1:
-                ol.append(child)
-        elif isinstance(child, MarkdownUL):
-            if len([child for child in child.args if isinstance(child, MarkdownLI)]) > 1:
-                ul.append(child)
-        elif isinstance(child, MarkdownH):
-            h.append(child)
-    if h:
-        breadth = len(h)
-    else:
-        if ol:
-            if len(ol) > 1:
-                return len(ol) + len(ul)
-            args = [child for child in ol[0].args if isinstance(child, MarkdownLI)]
+@functools.cache
+def breadth_rule(cls):
+    # the class whose rule gives the answer_breadth of the nodes of cls, the first in its mro among those with a rule of their own
+    return next((base for base in cls.__mro__ if base in (MarkdownOL, MarkdownUL, MarkdownH, MarkdownDocument, Markdown, XMLParser, XML)), None)
+
+class AnswerBreadth(AnswerDepth):
+    '''
+    answer_breadth and answer_depth of every node of a tree, the breadths computed bottom up in the reverse order of tree.dfs() after the depths,
+    with the MarkdownLI of each list counted once:
+    a list counts its MarkdownLI, a MarkdownH or MarkdownDocument its sections by section_breadth, any other node 1;
+    None stands for a breadth that is undefined, which answer_breadth raises as a ValueError.
+    '''
+    def __init__(self, tree):
+        super().__init__(tree)
+        nodes = self.nodes
+        kinds = self.kinds
+        args = self.args
+        # the number of MarkdownLI of each MarkdownOL and MarkdownUL
+        self.items = items = [0] * len(kinds)
+        self.breadth = breadth = [None] * len(nodes)
+        for i in range(len(nodes) - 1, -1, -1):
+            if kinds[i] & (OL | UL):
+                items[i] = sum(1 for j in args[i] if kinds[j] & LI)
+
+            rule = breadth_rule(type(nodes[i]))
+            if rule is MarkdownOL or rule is MarkdownUL:
+                breadth[i] = items[i]
+            elif rule is MarkdownH or rule is MarkdownDocument:
+                try:
+                    breadth[i] = self.section_breadth(nodes[i], args[i])
+                except Exception:
+                    # a section whose header cannot be read
+                    ...
+            elif rule is not None:
+                breadth[i] = 1
+
+    def answer_breadth(self, node):
+        return self.value(self.breadth, node, 'answer_breadth')
+
+    def section_breadth(self, node, indices):
+        # answer_breadth of MarkdownH and MarkdownDocument, from the metrics of its args at indices
+        kinds = self.kinds
+        items = self.items
+        ol = []
+        ul = []
+        h = []
+        for i in indices:
+            kind = kinds[i]
+            if kind & OL:
+                if items[i] > 1:
+                    ol.append(i)
+            elif kind & UL:
+                if items[i] > 1:
+                    ul.append(i)
+            elif kind & H:
+                h.append(i)
+        if h:
+            breadth = len(h)
+        else:
+            if ol:
+                if len(ol) > 1:
+                    return len(ol) + len(ul)
+                i = ol[0]
+                if ul:
+                    for j in self.args[i]:
+                        if kinds[j] & LI:
+                            if (depth := self.depth[j]) is None:
+                                return None
+                            if depth > 1:
+                                return items[i] + len(ul)
+                    return 1 + len(ul)
+                else:
+                    return items[i]
             if ul:
-                if any(child.answer_depth > 1 for child in args):
-                    return len(args) + len(ul)
-                return 1 + len(ul)
-            else:
-                return len(args)
-        if ul:
-            return len(ul) if len(ul) > 1 else len([child for child in ul[0].args if isinstance(child, MarkdownLI)])
-        return 0
-    if breadth == 1 and not ol and not ul:
-        return h[0].answer_breadth
-    header = h[-1].args[0]
-    if is_conclusion(str(header)):
-        breadth -= 1
-    return breadth + len(ol) + len(ul)
+                return len(ul) if len(ul) > 1 else items[ul[0]]
+            return 0
+        if breadth == 1 and not ol and not ul:
+            return self.breadth[h[0]]
+        header = self.nodes[h[-1]].args[0]
+        if is_conclusion(str(header)):
+            breadth -= 1
+        return breadth + len(ol) + len(ul)
 
 def answer_breadth(prompt, answer):
     if isinstance(answer, str):
@@ -62,11 +108,11 @@ def answer_breadth(prompt, answer):
         tree = MarkdownParser.instance.build(answer)
     else:
         tree = answer
-    tree.answer_depth = 1
+    metrics = AnswerBreadth.of(tree)
     max_answer_breadth = -1
     node = None
-    for arg in tree.dfs():
-        answer_breadth = arg.answer_breadth
+    for arg in metrics.nodes:
+        answer_breadth = metrics.answer_breadth(arg)
         if answer_breadth > max_answer_breadth:
             max_answer_breadth = answer_breadth
             node = arg
@@ -135,6 +181,149 @@ def test_table(id=None, Rank=None, offset=0):
         if hit:
             MySQL.instance().executemany("update corpus.reward set label = json_set(label, '$[2]', 'answer_breadth_error') where id = %s", [(id,)])
 
+def test_answer_metrics(folder='std/src/hash/test/'):
+    '''
+    check that AnswerBreadth, and the answer_depth and answer_breadth properties reading it, give the same metrics as the recursive answer_depth setter and answer_breadth properties
+    it replaced, on the markdown trees built from the files under folder, also after removing and pushing back args of the nodes and on copied and unpickled trees,
+    and print the time spent by the recursion and by AnswerBreadth.
+    '''
+    import copy, pickle, time, random
+    from collections import defaultdict
+    from std import listdir
+
+    def recursion(tree):
+        # the metrics of every node as the recursive setter and properties computed them, None for those that raised
+        depths = {}
+
+        def assign(self, depth):
+            depths[id(self)] = depth
+            if not isinstance(self, MarkdownArgs):
+                return
+            args = self.args
+            if self.has_heading_elements():
+                level2children = defaultdict(list)
+                for child in args:
+                    if isinstance(child, MarkdownH):
+                        level2children[child.level].append(child)
+                min_level = min(level2children.keys())
+                depth_heading = depth
+                if len(level2children[min_level]) > 1:
+                    depth_heading += 1
+                current_level = 0
+                for child in args:
+                    if isinstance(child, MarkdownH):
+                        current_level = child.level
+                    depth_child = current_level - min_level
+                    depth_child += depth_heading if current_level else depth
+                    if depth_child < 0:
+                        depth_child = depth
+                    assign(child, depth_child)
+            else:
+                depth_list = depth
+                if isinstance(self, (MarkdownUL, MarkdownOL)):
+                    if sum(isinstance(child, MarkdownLI) for child in args) > 1:
+                        depth_list += 1
+                    is_list = lambda self: isinstance(self, MarkdownLI)
+                elif not isinstance(self, MarkdownLI):
+                    if sum(isinstance(child, (MarkdownUL, MarkdownOL, MarkdownTABLE)) for child in args) > 1:
+                        depth_list += 1
+                    is_list = lambda self: isinstance(self, (MarkdownUL, MarkdownOL))
+                else:
+                    is_list = lambda _: False
+                for child in args:
+                    assign(child, depth_list if is_list(child) else depth)
+
+        def depth(self):
+            if isinstance(self, MarkdownArgs):
+                return max(depth(child) for child in self.args)
+            return depths[id(self)]
+
+        def items(self):
+            return [child for child in self.args if isinstance(child, MarkdownLI)]
+
+        def breadth(self):
+            if isinstance(self, (MarkdownOL, MarkdownUL)):
+                return len(items(self))
+            if not isinstance(self, (MarkdownH, MarkdownDocument)):
+                if isinstance(self, (Markdown, XMLParser, XML)):
+                    return 1
+                raise AttributeError('answer_breadth')
+            ol = [child for child in self.args if isinstance(child, MarkdownOL) and len(items(child)) > 1]
+            ul = [child for child in self.args if isinstance(child, MarkdownUL) and len(items(child)) > 1]
+            h = [child for child in self.args if isinstance(child, MarkdownH)]
+            if not h:
+                if ol:
+                    if len(ol) > 1:
+                        return len(ol) + len(ul)
+                    if ul:
+                        if any(depth(child) > 1 for child in items(ol[0])):
+                            return len(items(ol[0])) + len(ul)
+                        return 1 + len(ul)
+                    return len(items(ol[0]))
+                if ul:
+                    return len(ul) if len(ul) > 1 else len(items(ul[0]))
+                return 0
+            if len(h) == 1 and not ol and not ul:
+                return breadth(h[0])
+            return len(h) - bool(is_conclusion(str(h[-1].args[0]))) + len(ol) + len(ul)
+
+        assign(tree, 1)
+        metrics = []
+        for node in tree.dfs():
+            for func in (depth, breadth):
+                try:
+                    metrics.append(func(node))
+                except Exception:
+                    metrics.append(None)
+        return metrics
+
+    def flat(tree, properties=False):
+        # the metrics read from AnswerBreadth.of(tree), or from the properties of the Markdown nodes, which delegate to it
+        metrics = AnswerBreadth.of(tree)
+        values = []
+        for node in tree.dfs():
+            for name in ('answer_depth', 'answer_breadth'):
+                try:
+                    values.append(getattr(node, name) if properties and isinstance(node, Markdown) else getattr(metrics, name)(node))
+                except ValueError:
+                    values.append(None)
+        return values
+
+    rand = random.Random(0)
+    cost = [0, 0]
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            text = preprocess(f.read())
+        try:
+            tree = MarkdownParser.instance.build(text)
+        except Exception:
+            continue
+
+        start = time.perf_counter()
+        expected = recursion(tree)
+        cost[0] += time.perf_counter() - start
+        start = time.perf_counter()
+        AnswerBreadth.of(tree)
+        cost[1] += time.perf_counter() - start
+
+        assert flat(tree) == expected, f'{file}: metrics differ from the recursion'
+        assert flat(tree, properties=True) == expected, f'{file}: properties differ from the recursion'
+        assert AnswerBreadth.of(tree) is AnswerBreadth.of(tree), 'metrics of a tree are computed again'
+        assert flat(copy.deepcopy(tree)) == flat(pickle.loads(pickle.dumps(tree))) == expected, f'{file}: metrics of a copied tree differ'
+        for _ in range(3):
+            if not (parents := [node for node in tree.dfs() if isinstance(node, MarkdownArgs) and len(node.args) > 1]):
+                break
+            parent = rand.choice(parents)
+            child = rand.choice(parent.args)
+            parent.removeChild(child)
+            AnswerBreadth.clear(tree)
+            assert flat(tree) == recursion(tree), f'{file}: metrics differ from the recursion after removeChild'
+            parent.push(child)
+            AnswerBreadth.clear(tree)
+            assert flat(tree) == recursion(tree), f'{file}: metrics differ from the recursion after push'
+
+    print(f'answer_breadth and answer_depth of every node by the recursion in {cost[0]:.3f}s, by AnswerBreadth in {cost[1]:.3f}s')
+
 def test():
     from std.file import Text
     file = f"std/src/hash/test/test-27.txt"
@@ -1,5 +1,6 @@
 # cd ../keras && bash run.sh std.parser.reward.answer_depth.test_table &
 # python std/parser/reward/answer_depth.py
+import functools, operator
 from collections import defaultdict
 from std.parser.markdown import *
 from std import __set__
@@ -11,62 +12,138 @@ def has_heading_elements(self):
         for arg in self.args
     )
 
+def tree_of(node):
+    # the top of the tree node is part of, whose metrics node is read from
+    while (parent := node.parent) is not None:
+        node = parent
+    return node
+
 @__set__(Markdown)
 @property
 def answer_depth(self):
-    return self.kwargs['answer_depth']
+    # the depth of the node once the top of its tree is given a depth of 1, read from the metrics of the tree, see AnswerDepth
+    return AnswerDepth.of(tree_of(self)).answer_depth(self)
 
-@__set__(Markdown)
-@answer_depth.setter
-def answer_depth(self, depth):
-    self.kwargs['answer_depth'] = depth
+# the kinds of nodes told apart by AnswerDepth and AnswerBreadth, as bit flags
+ARGS, H, LI, OL, UL, TABLE = (1 << i for i in range(6))
 
+@functools.cache
+def node_kind(cls):
+    return sum(flag for flag, kind in ((ARGS, MarkdownArgs), (H, MarkdownH), (LI, MarkdownLI), (OL, MarkdownOL), (UL, MarkdownUL), (TABLE, MarkdownTABLE)) if issubclass(cls, kind))
 
-@__set__(MarkdownArgs)
-@property
-def answer_depth(self):
-    return max(child.answer_depth for child in self.args)
+class AnswerDepth:
+    '''
+    answer_depth of every node of a tree whose top is given a depth of 1:
+    the depths are assigned top down in the order of tree.dfs(), each MarkdownArgs dividing its depth among its args by the rules of assign,
+    then the maximum depth of each MarkdownArgs is taken bottom up in the reverse order, which visits the args of a node before it.
+    the depths are kept in flat lists indexed by the position of the node in tree.dfs(), None standing for a depth that is undefined,
+    such as that of a MarkdownArgs without args, which answer_depth raises as a ValueError.
+    the metrics are computed once per tree and cached on it, but not copied or pickled with it, since they look the nodes up by id;
+    a tree must not be mutated once scored, or its metrics have to be computed again after AnswerDepth.clear(tree).
+    '''
+    def __init__(self, tree):
+        self.nodes = nodes = [*tree.dfs()]
+        self.index = index = {id(node): i for i, node in enumerate(nodes)}
+        self.kinds = kinds = [node_kind(type(node)) for node in nodes]
+        # the positions of the args of each MarkdownArgs, the args that tree.dfs() does not visit, such as embedded parsers, given positions past the nodes
+        self.args = args = [None] * len(nodes)
+        assigned = [None] * len(nodes)
+        assigned[0] = 1
+        for i, node in enumerate(nodes):
+            if kinds[i] & ARGS:
+                indices = args[i] = [index.get(id(child)) for child in node.args]
+                if None in indices:
+                    for k, child in enumerate(node.args):
+                        if indices[k] is None:
+                            indices[k] = index[id(child)] = len(assigned)
+                            assigned.append(None)
+                            kinds.append(node_kind(type(child)))
+                if indices and (depth := assigned[i]) is not None:
+                    for j, depth in zip(indices, self.assign(node, kinds[i], depth, [kinds[j] for j in indices])):
+                        assigned[j] = depth
 
-@__set__(MarkdownArgs)
-@answer_depth.setter
-def answer_depth(self, depth):
-    self.kwargs['answer_depth'] = depth
-    args = self.args
-    if self.has_heading_elements():
-        level2children = defaultdict(list)
-        for child in args:
-            if isinstance(child, MarkdownH):
-                level2children[child.level].append(child)
-
-        min_level = min(level2children.keys())
-        depth_heading = depth
-        if len(level2children[min_level]) > 1:
-            depth_heading += 1
-
-        current_level = 0
-        for child in args:
-            if isinstance(child, MarkdownH):
-                current_level = child.level
-            depth_child = current_level - min_level
-            depth_child += depth_heading if current_level else depth
-            if depth_child < 0:
-                depth_child = depth
-            child.answer_depth = depth_child
-    else:
-        depth_list = depth
-        if isinstance(self, (MarkdownUL, MarkdownOL)):
-            if sum(isinstance(child, MarkdownLI) for child in args) > 1:
-                depth_list += 1
-            is_list = lambda self: isinstance(self, MarkdownLI)
-        elif not isinstance(self, MarkdownLI):
-            if sum(isinstance(child, (MarkdownUL, MarkdownOL, MarkdownTABLE)) for child in args) > 1:
-                depth_list += 1
-            is_list = lambda self: isinstance(self, (MarkdownUL, MarkdownOL))
+        self.depth = depth = assigned
+        for i in range(len(nodes) - 1, -1, -1):
+            if (indices := args[i]) is not None:
+                depth[i] = self.max(depth, indices)
+
+    @classmethod
+    def of(cls, tree):
+        # the metrics of tree, computed on the first call and cached on tree; a shallow copy of tree, which shares its __dict__, computes its own
+        metrics = tree.__dict__.get('answer_metrics')
+        if not isinstance(metrics, cls) or metrics.nodes[0] is not tree:
+            metrics = tree.__dict__['answer_metrics'] = cls(tree)
+        return metrics
+
+    @staticmethod
+    def clear(tree):
+        # drop the metrics cached on tree, to be called once tree is mutated after being scored
+        tree.__dict__.pop('answer_metrics', None)
+
+    def __deepcopy__(self, memo):
+        # a copy of the tree computes its own metrics
+        return None
+
+    def __reduce__(self):
+        return type(None), ()
+
+    def answer_depth(self, node):
+        return self.value(self.depth, node, 'answer_depth')
+
+    def value(self, values, node, name):
+        # the value of node in values, raised as a ValueError if undefined
+        if (i := self.index.get(id(node))) is None or (value := values[i]) is None:
+            raise ValueError(f'{name} of {node.func} is undefined')
+        return value
+
+    @staticmethod
+    def assign(self, kind, depth, kinds):
+        # the depths assigned to the args of self, of the given kinds, by self.answer_depth = depth
+        union = functools.reduce(operator.or_, kinds)
+        if union & H:
+            args = self.args
+            level2children = defaultdict(list)
+            for child, kind in zip(args, kinds):
+                if kind & H:
+                    level2children[child.level].append(child)
+
+            min_level = min(level2children.keys())
+            depth_heading = depth
+            if len(level2children[min_level]) > 1:
+                depth_heading += 1
+
+            depths = []
+            current_level = 0
+            for child, kind in zip(args, kinds):
+                if kind & H:
+                    current_level = child.level
+                depth_child = current_level - min_level
+                depth_child += depth_heading if current_level else depth
+                if depth_child < 0:
+                    depth_child = depth
+                depths.append(depth_child)
+            return depths
+
+        if not union & (LI | OL | UL):
+            return [depth] * len(kinds)
+        if kind & (OL | UL):
+            is_list = [kind & LI for kind in kinds]
+            lists = len(kinds) - is_list.count(0)
+        elif not kind & LI:
+            is_list = [kind & (OL | UL) for kind in kinds]
+            lists = sum(1 for kind in kinds if kind & (OL | UL | TABLE))
         else:
-            is_list = lambda _: False
+            lists = 0
+        if lists <= 1:
+            return [depth] * len(kinds)
+        return [depth + 1 if is_list else depth for is_list in is_list]
 
-        for child in args:
-            child.answer_depth = depth_list if is_list(child) else depth
+    @staticmethod
+    def max(values, indices):
+        # the maximum of values at indices, undefined if there are none or any of them is undefined
+        values = [values[i] for i in indices]
+        if values and None not in values:
+            return max(values)
 
 def preprocess(answer):
     answer = re.sub(r'(?<=[:：]|\*\*)\n+(?=[a-zA-Z\p{Han}])', lambda m : ' ' * len(m[0]), answer)
@@ -81,9 +158,8 @@ def answer_depth(prompt, answer, **kwargs):
         tree = MarkdownParser.instance.build(answer)
     else:
         tree = answer
-    tree.answer_depth = 1
     return {
-        'score' : tree.answer_depth
+        'score' : AnswerDepth.of(tree).answer_depth(tree)
     }
 
 
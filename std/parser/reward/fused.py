@@ -0,0 +1,103 @@
+# python std/parser/reward/fused.py
+from std.parser.markdown import MarkdownParser, convert_block_latex
+from std.parser.reward.answer_depth import answer_depth, preprocess
+from std.parser.reward.answer_breadth import answer_breadth
+from std.parser.reward.writing_style import min_length_of_paragraphs_in_sliding_window
+from std.nlp.lang import language_consistency
+from std.cpp import repetition_penalty
+
+# for each scorer: the text its markdown tree is built from, and how it is called with that tree
+scorers = {
+    'answer_breadth': (
+        lambda answer, **_: preprocess(answer),
+        lambda prompt, answer, tree, **kwargs: answer_breadth(prompt, answer if tree is None else tree)
+    ),
+    'answer_depth': (
+        lambda answer, **kwargs: preprocess(answer) if kwargs.get('preprocess') else answer,
+        lambda prompt, answer, tree, **kwargs: answer_depth(prompt, answer if tree is None else tree, **kwargs)
+    ),
+    'language_consistency': (
+        lambda answer, **_: convert_block_latex(answer),
+        lambda prompt, answer, tree, **kwargs: language_consistency(prompt, answer, tree=tree, **kwargs)
+    ),
+    'min_length_of_paragraphs_in_sliding_window': (
+        lambda answer, **_: answer,
+        lambda prompt, answer, tree, **kwargs: min_length_of_paragraphs_in_sliding_window(answer, tree=tree, **kwargs)
+    ),
+    'repetition_penalty': (
+        lambda answer, **_: answer,
+        lambda prompt, answer, tree, **kwargs: repetition_penalty(prompt, answer, tree=tree, **kwargs)
+    ),
+}
+
+
+def reward(prompt, answer, metrics=tuple(scorers)):
+    '''
+    score answer with the reward scorers named in metrics, building the markdown tree of each distinct text they parse only once.
+    the scorers that parse the answer as it is share one tree, answer_breadth parses it preprocessed and language_consistency with its block latex converted,
+    which leaves most answers, and so their trees, unchanged.
+    metrics is either an iterable of scorer names, or a dict mapping each scorer name to the keyword arguments it is called with.
+    returns {metric: the result of the scorer}, the same as calling each scorer on its own.
+    '''
+    if not isinstance(metrics, dict):
+        metrics = {metric: {} for metric in metrics}
+
+    trees = {}
+    results = {}
+    for metric, kwargs in metrics.items():
+        text, score = scorers[metric]
+        text = text(answer, **kwargs)
+        if text not in trees:
+            try:
+                trees[text] = MarkdownParser.instance.build(text)
+            except Exception:
+                # left to the scorer to build it again, so that it fails the way it does on its own
+                trees[text] = None
+        results[metric] = score(prompt, answer, trees[text], **kwargs)
+    return results
+
+
+def test(folder='std/src/hash/test/'):
+    '''
+    check that reward returns the same results as the scorers called one by one on the files under folder, and print the time spent by each way.
+    '''
+    import time
+    from std import listdir
+
+    def normalize(result):
+        return result.toJson() if hasattr(result, 'toJson') else result
+
+    answers = []
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            answers.append(f.read())
+
+    prompt = 'Please answer the question in English.'
+    cost = [0, 0]
+    for answer in answers:
+        start = time.perf_counter()
+        expected = {}
+        for metric, (_, score) in scorers.items():
+            try:
+                expected[metric] = normalize(score(prompt, answer, None))
+            except Exception as e:
+                expected[metric] = repr(e)
+        cost[0] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            results = {metric: normalize(result) for metric, result in reward(prompt, answer).items()}
+        except Exception as e:
+            results = None
+            error = repr(e)
+        cost[1] += time.perf_counter() - start
+        if results is None:
+            assert error in expected.values(), f'{error} raised by reward but not by the scorers'
+        else:
+            assert results == expected, 'results of reward differ from those of the scorers'
+
+    print(f'{len(answers)} answers scored by {len(scorers)} scorers: one by one in {cost[0]:.3f}s, by reward in {cost[1]:.3f}s, speedup {cost[0] / cost[1]:.2f}x')
+
+
+if __name__ == '__main__':
+    test()
@@ -1,6 +1,7 @@
 import regex as re
-import sys
-from std.unicode import strlen
+import sys, itertools
+from std.unicode import strlen, width_offsets, collapsed_widths
+from std.nlp.segment import paragraph_spans
 from std import __set__, scan_conditionally, json_encode
 from std.parser.markdown import *
 
@@ -29,15 +30,10 @@ def merge(self, text, window_size):
     @classmethod
     def from_texts(cls, texts, window_size, min_avg=sys.maxsize):
         # Find the window with the minimum average length
-        target_start = -1
         texts_striped = [re.sub(r'\s+', ' ', text) for text in texts]
         texts.clear()
         [*texts] = filter(lambda s : s, texts_striped)
-        for i in range(len(texts) - window_size + 1):
-            window_avg = sum(strlen(s) for s in texts[i:i + window_size]) / window_size
-            if window_avg < min_avg:
-                min_avg = window_avg
-                target_start = i
+        min_avg, target_start = min_window([strlen(s) for s in texts], window_size, min_avg)
 
         if target_start < 0:
             window_size = 0
@@ -47,6 +43,63 @@ def from_texts(cls, texts, window_size, min_avg=sys.maxsize):
         )
         return style
 
+    @classmethod
+    def from_spans(cls, text, spans, window_size, min_avg=sys.maxsize):
+        '''
+        from_texts over the slices text[start:stop] of spans, with their widths taken from the prefix arrays of text,
+        so that only the texts of the window found are built
+        '''
+        spans = [(start, stop) for start, stop in spans if start < stop]
+        lengths = collapsed_widths(width_offsets(text), [start for start, _ in spans], [stop for _, stop in spans]).tolist()
+        min_avg, target_start = min_window(lengths, window_size, min_avg)
+
+        if target_start < 0:
+            window_size = 0
+        return cls(
+            min_avg,
+            [re.sub(r'\s+', ' ', text[start:stop]) for start, stop in spans[target_start: target_start + window_size]]
+        )
+
+    @classmethod
+    def from_texts_batch(cls, documents, window_sizes, min_avg=sys.maxsize):
+        '''
+        from_texts over each list of texts in documents for each of window_sizes, as [[style for window_size in window_sizes] for texts in documents]:
+        the widths of the texts of all the documents are summed into one prefix array, from which the windows of all the documents are averaged at once for each window size.
+        unlike from_texts, the lists of texts are left as they are.
+        '''
+        import numpy as np
+        documents = [[s for s in (re.sub(r'\s+', ' ', text) for text in texts) if s] for texts in documents]
+        counts = np.array([len(texts) for texts in documents], np.int64)
+        bounds = np.zeros(len(documents) + 1, np.int64)
+        np.cumsum(counts, out=bounds[1:])
+        prefix = np.zeros(bounds[-1] + 1, np.int64)
+        np.cumsum([strlen(s) for texts in documents for s in texts], out=prefix[1:])
+
+        styles = [[] for _ in documents]
+        for window_size in window_sizes:
+            windows = np.maximum(counts - window_size + 1, 0)
+            first = np.zeros(len(documents) + 1, np.int64)
+            np.cumsum(windows, out=first[1:])
+            # the document of each window, and the index of its first text in the prefix array
+            document = np.repeat(np.arange(len(documents)), windows)
+            starts = bounds[:-1][document] + np.arange(first[-1]) - first[:-1][document]
+            averages = (prefix[starts + window_size] - prefix[starts]) / window_size
+
+            # the first window of each document reaching the minimum of its averages
+            minimums = np.full(len(documents), np.inf)
+            target_starts = np.full(len(documents), -1)
+            if (nonempty := windows > 0).any():
+                minimums[nonempty] = np.minimum.reduceat(averages, first[:-1][nonempty])
+                hits = np.flatnonzero(averages == minimums[document])
+                target_starts[nonempty] = hits[np.searchsorted(hits, first[:-1][nonempty])] - first[:-1][nonempty]
+
+            for texts, style, minimum, target_start in zip(documents, styles, minimums.tolist(), target_starts.tolist()):
+                if target_start >= 0 and minimum < min_avg:
+                    style.append(cls(minimum, texts[target_start:target_start + window_size]))
+                else:
+                    style.append(cls(min_avg, []))
+        return styles
+
     def toJson(self):
         return {
             'score': self.min_avg_length,
@@ -57,15 +110,29 @@ def toJson(self):
     def __str__(self):
         return json_encode(self.toJson(), indent=4)
 
+def min_window(lengths, window_size, min_avg=sys.maxsize):
+    '''
+    the minimum average of window_size consecutive lengths if it is below min_avg, with the start of the first window reaching it, or else (min_avg, -1):
+    the sums of all the windows are differences of the prefix sums of lengths, in O(len(lengths)) whatever window_size.
+    the prefix sums are accumulated by python, as the paragraphs scanned by scan_list are too few for numpy to pay off; see from_texts_batch for many documents.
+    '''
+    if len(lengths) < window_size:
+        return min_avg, -1
+    prefix = [0, *itertools.accumulate(lengths)]
+    averages = [(stop - start) / window_size for start, stop in zip(prefix, prefix[window_size:])]
+    start = min(range(len(averages)), key=averages.__getitem__)
+    if averages[start] < min_avg:
+        return averages[start], start
+    return min_avg, -1
+
 @__set__(Markdown)
 def scan_element(self, texts):
     texts.extend((text.strip() for text in re.split("\n+", str(self).strip())))
 
 @__set__(MarkdownP, MarkdownSPAN, MarkdownText)
 def scan_list(self, window_size):
-    texts = []
-    self.scan_element(texts)
-    return WritingStyle.from_texts(texts, window_size)
+    text = str(self)
+    return WritingStyle.from_spans(text, paragraph_spans(text), window_size)
 
 @__set__(MarkdownH)
 def scan_list(self, window_size):
@@ -117,7 +184,7 @@ def scan_array(l):
     style.merge(texts, window_size)
     return style
 
-def min_length_of_paragraphs_in_sliding_window(text, window_size=5):
+def min_length_of_paragraphs_in_sliding_window(text, window_size=5, tree=None):
     """
     Find the sliding window of consecutive paragraphs with the minimum average length after processing.
     
@@ -129,12 +196,15 @@ def min_length_of_paragraphs_in_sliding_window(text, window_size=5):
         window_size (int): Number of consecutive paragraphs to consider in each window.
         no_ref_only (bool): If True, exclude paragraphs containing reference markers like [1], [2], etc.
         min_avg (float): Initial minimum average value (defaults to maximum system value).
+        tree (MarkdownArgs, optional): markdown tree already built from text, so as not to build it again.
     
     Returns:
         dict: Contains 'min_avg_length' (minimum average length in bytes), 
               'start'/'stop' (indices in original text for the best window).
     """
-    return MarkdownParser.instance.build(text).scan_list(window_size)
+    if tree is None:
+        tree = MarkdownParser.instance.build(text)
+    return tree.scan_list(window_size)
 
 
 def test_table(id=None, Rank=None, offset=0):
@@ -248,6 +318,63 @@ def test():
 
     print(min_length_of_paragraphs_in_sliding_window(text))
 
+def test_from_spans(folder='std/src/hash/test/', count=20000):
+    '''
+    check that from_spans over paragraph_spans finds the same window as from_texts over the paragraphs split by scan_element,
+    on the files under folder and on random texts of wide characters and whitespace.
+    '''
+    import random
+    from std import listdir
+
+    texts = []
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+
+    rand = random.Random(0)
+    alphabet = 'ab 中文　\t\n\n\r\x1c,é😀'
+    texts += [''.join(rand.choice(alphabet) for _ in range(rand.randint(0, 40))) for _ in range(count)]
+    for text in texts:
+        for window_size in (1, 2, 5):
+            paragraphs = [paragraph.strip() for paragraph in re.split("\n+", text.strip())]
+            expected = WritingStyle.from_texts(paragraphs, window_size).toJson()
+            assert WritingStyle.from_spans(text, paragraph_spans(text), window_size).toJson() == expected, f'{text!r}: windows differ'
+
+def test_from_texts_batch(folder='std/src/hash/test/', window_sizes=(1, 3, 5, 20), count=2000):
+    '''
+    check that from_texts_batch finds the same windows as from_texts on the paragraphs of the files under folder and on random lists of texts,
+    and print the time spent by the windows summed one by one, by from_texts and by from_texts_batch on all the paragraphs of the files as one document.
+    '''
+    import time, random
+    from std import listdir
+
+    documents = []
+    for file in sorted(listdir(folder, ext='.md')) + sorted(listdir(folder, ext='.txt')):
+        with open(file, 'r', encoding='utf-8') as f:
+            documents.append(re.split("\n+", f.read()))
+
+    rand = random.Random(0)
+    alphabet = 'ab 中文　\t,é'
+    documents += [[''.join(rand.choice(alphabet) for _ in range(rand.randint(0, 6))) for _ in range(rand.randint(0, 12))] for _ in range(count)]
+    expected = [[WritingStyle.from_texts([*texts], window_size).toJson() for window_size in window_sizes] for texts in documents]
+    assert [[style.toJson() for style in styles] for styles in WritingStyle.from_texts_batch(documents, window_sizes)] == expected, 'windows differ'
+
+    texts = [text for texts in documents[:-count] for text in texts]
+    start = time.perf_counter()
+    for window_size in window_sizes:
+        texts_ = [s for s in (re.sub(r'\s+', ' ', text) for text in texts) if s]
+        for i in range(len(texts_) - window_size + 1):
+            sum(strlen(s) for s in texts_[i:i + window_size]) / window_size
+    one_by_one = time.perf_counter() - start
+    start = time.perf_counter()
+    for window_size in window_sizes:
+        WritingStyle.from_texts([*texts], window_size)
+    prefix_sums = time.perf_counter() - start
+    start = time.perf_counter()
+    WritingStyle.from_texts_batch([texts], window_sizes)
+    batch = time.perf_counter() - start
+    print(f'{len(texts)} paragraphs, window sizes {window_sizes}: one by one {one_by_one:.3f}s, from_texts {prefix_sums:.3f}s, from_texts_batch {batch:.3f}s')
+
 if __name__ == '__main__':
     test()
     # test_table(
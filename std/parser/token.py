@@ -1,3 +1,4 @@
+import regex as re
 from .node import AbstractParser, Node, case 
 from .word import Word
 
@@ -9,9 +10,15 @@ def case(self, **kwargs):
         self.text += self.key
         return self
 
+    inert = re.compile('[%s]*' % ''.join(map(re.escape, ascii)))
+
+    def push_text(self, text, **kwargs):
+        self.text += text
+        return self
+
     @case
     def case(self, **kwargs):
-        return self.parent.parse(**self.kwargs).parse(self.key, **kwargs)
+        return self.parent.parse(**self.kwargs_dict).parse(self.key, **kwargs)
     
     def strFormat(self):
         return self.text
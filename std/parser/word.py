@@ -10,7 +10,7 @@ def case(self, **kwargs):
 
     @case
     def case(self, **kwargs):
-        return self.parent.parse(**self.kwargs).parse(self.key, **kwargs)
+        return self.parent.parse(**self.kwargs_dict).parse(self.key, **kwargs)
     
     def strFormat(self):
         return self.text
@@ -1,10 +1,15 @@
 # to comply with the standards of java and mysql regex engine
-import traceback, regex as re
-from functools import partial
+import bisect, traceback, regex as re
+from functools import partial, cache
 from std import computed, clip, splice, binary_search
 from std.parser.newline import NewLineParser
 from std.parser.node import IndentedNode, clone, Closable, AbstractParser, case
-from std.sets import Range
+from std.sets import Range, Union
+
+@cache
+def inert_spaced(case):
+    # the inert regex of case, spaces included
+    return re.compile('[^%s]*' % ''.join(re.escape(key) for key in case.map if len(key) == 1 and key != ' '))
 
 def add(arr, val):
     return [x + val for x in arr]
@@ -15,6 +20,8 @@ class XML(IndentedNode):
     is_XMLVoidTag = False
     is_XMLArgs = False
     is_XMLUnbalancedTag = False
+    # whether insert_space takes a space as any other token, so that a run of text pushed under this node can go on past spaces
+    space_inert = False
     
     def has_recursive_error(self):
         try:
@@ -64,29 +71,200 @@ def modify_style(self, tag):
     def length(self):
         return self.end_idx - self.start_idx
 
+    @computed
+    def style_runs(self):
+        '''
+        the style of the text as maximal runs [(start, stop, style_traits)] covering [0, len(text)),
+        style_traits being the '.'-joined sorted tags of the run, swept over the boundaries of the Range/Union of each tag in self.style
+        '''
+        size = len(self.text)
+        events = {}
+        for tag, s in self.style.items():
+            for s in s.args if s.is_Union else [s] if s.is_Range else ():
+                start, stop = max(s.start, 0), min(s.stop, size)
+                if start < stop:
+                    events.setdefault(start, []).append((tag, 1))
+                    events.setdefault(stop, []).append((tag, -1))
+
+        runs = []
+        count = {}
+        start, traits = 0, ''
+        for i in sorted(events):
+            for tag, delta in events[i]:
+                count[tag] = count.get(tag, 0) + delta
+            style = '.'.join(sorted(tag for tag, n in count.items() if n > 0))
+            if style != traits:
+                if i > start:
+                    runs.append((start, i, traits))
+                start, traits = i, style
+        if size > start:
+            runs.append((start, size, traits))
+        return runs
+
+    @computed
+    def style_map(self):
+        '''
+        {style_traits: Range | Union} of the characters sharing exactly those tags, the unstyled ones mapped from ''
+        '''
+        return self.style_over(0, len(self.text))
+
+    def style_over(self, start, stop):
+        '''
+        {style_traits: Range | Union} of the characters in [start, stop), found by bisecting the style runs
+        '''
+        runs = self.style_runs
+        style = {}
+        for i in range(bisect.bisect_right(runs, (start, float('inf'))) - 1 if runs else 0, len(runs)):
+            begin, end, traits = runs[i]
+            if begin >= stop:
+                break
+            begin, end = max(begin, start), min(end, stop)
+            if begin < end:
+                style.setdefault(traits, []).append(Range(begin, end))
+        return {traits: Union.new(*args) for traits, args in style.items()}
+
+    def style_ids(self, numpy=False):
+        '''
+        the style of each character as an id into the interned style traits, materialized from the style runs on demand.
+        returns (ids, traits) with traits[ids[i]] == style_traits[i], ids being a numpy int32 array if numpy is True else a list
+        '''
+        runs = self.style_runs
+        traits = [*dict.fromkeys(traits for *_, traits in runs)]
+        intern = {style: i for i, style in enumerate(traits)}
+        if numpy:
+            import numpy as np
+            lengths = np.fromiter((stop - start for start, stop, _ in runs), dtype=np.int64, count=len(runs))
+            ids = np.repeat(np.fromiter((intern[style] for *_, style in runs), dtype=np.int32, count=len(runs)), lengths)
+        else:
+            ids = []
+            for start, stop, style in runs:
+                ids += [intern[style]] * (stop - start)
+        return ids, traits
+
     @computed
     def style_traits(self):
-        style_traits = [''] * len(self.text)
-        for i, s in enumerate(self.style_input):
-            s = [*s]
-            s.sort()
-            s = '.'.join(s)
-            style_traits[i] = s
+        style_traits = []
+        for start, stop, traits in self.style_runs:
+            style_traits += [traits] * (stop - start)
         return style_traits
     
     @computed
     def style_input(self):
-        style_input = [set() for _ in range(len(self.text))]
-        for tag, s in self.style.items():
-            if s.is_Range:
-                for i in range(s.start_idx, s.end_idx):
-                    style_input[i].add(tag)
-            elif s.is_Union:
-                for s in s.args:
-                    for i in range(s.start_idx, s.end_idx):
-                        style_input[i].add(tag)
+        style_input = []
+        for start, stop, traits in self.style_runs:
+            tags = traits.split('.') if traits else ()
+            style_input += (set(tags) for _ in range(start, stop))
         return style_input
 
+    @computed
+    def physicalIndices(self):
+        '''
+        numpy int array of len(self.text) + 1 non-decreasing offsets, mapping each logical offset into self.text to its physical offset into the source text,
+        the end of the text to the end of its last character. built in one pass over the XMLText leaves, whose start_idx locate their text in the source;
+        the few leaves that are not a slice of it, because the parser dropped the blanks between their line breaks, are aligned to the source kept by XMLParser.build,
+        the spaces a tab was expanded into sharing the offset of the tab
+        '''
+        import numpy as np
+        starts = []
+        texts = []
+        for node in self.dfs_preorder(XMLText):
+            if node.text:
+                starts.append(node.start_idx)
+                texts.append(node.text)
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        shifts = np.array(starts, dtype=np.int64) - (np.cumsum(lengths) - lengths)
+        physicalIndices = np.empty(lengths.sum() + 1, dtype=np.int64)
+        physicalIndices[:-1] = np.repeat(shifts, lengths) + np.arange(len(physicalIndices) - 1)
+
+        if (source := self.source) is not None:
+            offset = 0
+            for k, (start, text) in enumerate(zip(starts, texts)):
+                if source.startswith(text, start):
+                    offset += len(text)
+                    continue
+                # the search never runs past the next leaf, and the spaces a tab was expanded into all point at the tab
+                stop = starts[k + 1] if k + 1 < len(starts) else len(source)
+                pos = start
+                expanded = 0
+                for ch in text:
+                    while start < stop and source[start] != ch and source[start] in ' \t\r' and not (ch == ' ' and source[start] == '\t'):
+                        start += 1
+                    if start < stop and source[start] == ch:
+                        pos = start
+                        start += 1
+                    elif start < stop and source[start] == '\t' and ch == ' ':
+                        pos = start
+                        expanded += 1
+                        if expanded == 4:
+                            expanded = 0
+                            start += 1
+                    else:
+                        pos = max(pos, min(start, stop - 1))
+                    physicalIndices[offset] = pos
+                    offset += 1
+
+        physicalIndices[-1] = physicalIndices[-2] + 1 if len(physicalIndices) > 1 else 0
+        return physicalIndices
+
+    @property
+    def source(self):
+        # the text that the tree was built from by XMLParser.build, None for a tree built otherwise
+        return getattr(root.parent, 'source', None) if (root := self.root) else None
+
+    @computed
+    def logicalIndices(self):
+        '''
+        numpy int array of physicalIndices[-1] + 1 increasing offsets, mapping each physical offset to the logical offset of the first character of self.text at or after it
+        '''
+        import numpy as np
+        physicalIndices = self.physicalIndices
+        return np.searchsorted(physicalIndices[:-1], np.arange(physicalIndices[-1] + 1))
+
+    def getPhysicalIndicesArray(self, starts, stops):
+        '''
+        the physical spans of the logical spans [starts, stops), given as arrays, looked up in physicalIndices at once;
+        the physical span runs from the first to the last character of the logical span, an empty span being mapped to an empty one
+        '''
+        import numpy as np
+        physicalIndices = self.physicalIndices
+        starts = np.asarray(starts)
+        stops = np.asarray(stops)
+        physical_starts = physicalIndices[starts]
+        physical_stops = np.where(stops > starts, physicalIndices[np.maximum(stops, 1) - 1] + 1, physical_starts)
+        return physical_starts, physical_stops
+
+    def sanity_check(self, physicalText=None):
+        '''
+        assert that physicalIndices and logicalIndices are non-decreasing, inverse to each other and point at the characters of self.text in physicalText,
+        the source text, which defaults to self.source, or to str(self) for a tree not built by XMLParser.build;
+        return the [(logical offset, physical offset by the array, by the per-node method)] at which the per-node logical2physical or physical2logical,
+        where they succeed, disagree with the arrays, the per-node offsets being taken from self.start_idx
+        '''
+        import numpy as np
+        text = self.text
+        if physicalText is None:
+            physicalText = self.source
+            if physicalText is None:
+                physicalText = str(self)
+        physicalIndices = self.physicalIndices
+        logicalIndices = self.logicalIndices
+        assert len(physicalIndices) == len(text) + 1 and len(logicalIndices) == physicalIndices[-1] + 1, 'offsets do not span the node'
+        assert (np.diff(physicalIndices) >= 0).all() and (np.diff(logicalIndices) >= 0).all(), 'offsets are not increasing'
+        assert all(j < len(physicalText) and (physicalText[j] == ch or ch == ' ' and physicalText[j] == '\t') for ch, j in zip(text, physicalIndices.tolist())), 'physicalIndices point at other characters'
+        assert (physicalIndices[logicalIndices[physicalIndices]] == physicalIndices).all(), 'logicalIndices do not invert physicalIndices'
+
+        mismatches = []
+        start_idx = self.start_idx
+        for i, j in enumerate(physicalIndices[:-1].tolist()):
+            try:
+                if (pos := start_idx + self.logical2physical(i)) != j:
+                    mismatches.append((i, j, pos))
+                elif self.physical2logical(j - start_idx) != i:
+                    mismatches.append((i, j, None))
+            except Exception:
+                ...
+        return mismatches
+
     @case(' ')
     def case(self, **kwargs):
         return self.parent.insert_space(self, **kwargs)
@@ -212,9 +390,22 @@ def append(self, new):
         raise Exception(f'append is not defined {new}: {self.__class__.__name__}')
 
     def push_token(self, word, **kwargs):
-        self.text += word
+        # drop the reference held by the slot first so that += can extend the string in place instead of copying it
+        text = self._text
+        self._text = None
+        text += word
+        self._text = text
         return self
 
+    def push_text(self, text, **kwargs):
+        return self.parent.insert_text(self, text, **kwargs)
+
+    @property
+    def inert(self):
+        if self.parent.space_inert:
+            return inert_spaced(self.case)
+        return self.case.inert
+
     def strFormat(self):
         return self.text
 
@@ -257,6 +448,7 @@ def has(self, cls):
 
 class XMLArgs(XML):
     is_XMLArgs = True
+    space_inert = True
     
     def __init__(self, args, indent=0, parent=None):
         super().__init__(indent, parent)
@@ -505,6 +697,10 @@ def getPhysicalIndices(self, start_idx, end_idx):
     def insert_token(self, caret, token, **kwargs):
         return caret.push_token(token, **kwargs)
 
+    def insert_text(self, caret, text, **kwargs):
+        # a run of default-case characters appended at once, the same as calling insert_token with each of them
+        return caret.push_token(text, **kwargs)
+
     def has_newline(self):
         return any(arg.has_newline() for arg in self.args)
 
@@ -531,6 +727,7 @@ def html(self):
         return ''.join(arg.html for arg in self.args)
 
 class XMLTagBase(XMLArgs):
+    space_inert = False
 
     @property
     def start_idx(self):
@@ -567,6 +764,15 @@ def insert_token(self, caret, token, **kwargs):
             return self.push_special(token, **kwargs)
         return caret.push_token(token, **kwargs)
 
+    # the characters that insert_token pushes out of a tag name or attribute text as special
+    special = re.compile(r"[`~@#$%^&()=+\[{\]}\\|,/?]")
+
+    def insert_text(self, caret, text, **kwargs):
+        # tag names and attributes treat some characters specially, a run free of them is appended to the text at once, otherwise parsed one by one
+        if isinstance(caret, XMLText) and not self.special.search(text):
+            return caret.push_token(text, **kwargs)
+        return None
+
     def insert_eq(self, caret, **kwargs):
         if caret is self.tagName and isinstance(caret, XMLCaret):
             return self.push_special('=', **kwargs)
@@ -848,6 +1054,8 @@ def push(self, arg):
         raise Exception(f"push operation not allowed for {self.__class__.__name__}")
 
 class XMLEq(XMLBinary):
+    space_inert = False
+
     def strFormat(self):
         return '%s=%s'
 
@@ -889,8 +1097,13 @@ def insert_exclamation(self, caret, **kwargs):
     def insert_token(self, caret, token, **kwargs):
         return self.parent.insert_token(self, token, **kwargs)
 
+    def insert_text(self, caret, text, **kwargs):
+        # the characters after '=' are parsed one by one
+        return None
+
 class XMLEntity(XMLUnary, Closable):
     is_XMLEntity = True
+    space_inert = False
     
     @property
     def start_idx(self):
@@ -920,6 +1133,12 @@ def insert_token(self, caret, token, **kwargs):
             return self.push_special(token, **kwargs)
         return super().insert_token(caret, token, **kwargs)
 
+    def insert_text(self, caret, text, **kwargs):
+        # the length of an entity name is bounded, a run that keeps it within 32 characters is appended at once, otherwise parsed one by one
+        if isinstance(caret, XMLText) and len(caret.text) + len(text) <= 32:
+            return caret.push_token(text, **kwargs)
+        return None
+
     # token in {"\t", "\n", "\f", ' ', '<', '&', '='}:
     def insert_ampersand(self, caret, **kwargs):
         return self.push_special('&', **kwargs)
@@ -1265,6 +1484,12 @@ def insert_token(self, caret, token, **kwargs):
                 return caret
         return caret.push_token(token, **kwargs)
 
+    def insert_text(self, caret, text, **kwargs):
+        # a text run inside markdown is handed back to markdown by insert_token
+        if not self.parent.parent:
+            return caret.push_token(text, **kwargs)
+        return None
+
     def insert_right_bracket(self, caret, **kwargs):
         this = self.parent
         if (md := this.parent) and isinstance(md, md.MarkdownBracket):
@@ -1312,7 +1537,13 @@ def plainText(self):
     def __str__(self):
         return str(self.root)
 
-    def build(self, text):
+    @staticmethod
+    def print_error(e):
+        print(e)
+        traceback.print_exc()
+
+    def build_debug(self, text):
+        self.source = text
         history = ''  # for debug purposes
         for start_idx, token in enumerate(text):
             try:
@@ -1327,6 +1558,17 @@ def build(self, text):
         self.parse('', start_idx=start_idx + 1)
         return self.root
 
+    def build(self, text):
+        '''
+        build the tree of text as build_debug does, without its history, the runs of text between the characters that the caret treats specially,
+        such as '<', '&', ';' and blanks, being found by the inert regex of the caret and pushed into the XMLText at once;
+        a character that raises, as in malformed markup, is skipped after its error is printed, as build_debug does
+        '''
+        self.source = text
+        self.parse_text(text, on_error=self.print_error)
+        self.parse('', start_idx=len(text) + 1)
+        return self.root
+
     @classmethod
     def match_XMLTagBegin(cls, arg, tagName):
         return isinstance(arg, cls) and len(args := arg.root.args) == 1 and isinstance(tagBegin := args[0], XMLTagBegin) and tagBegin.tagName.text.lower() == tagName
@@ -1341,5 +1583,158 @@ def test():
     print(tree)
 
 
+def test_style(size=200000, tags=('b', 'i', 'u', 'sub', 'sup', 'font'), repeat=3):
+    '''
+    check the style runs, style_over and style_ids of random style maps against the style of each character computed one by one,
+    and print the time spent by each way
+    '''
+    import time, random
+    rand = random.Random(0)
+
+    def random_style(size):
+        style = {}
+        for tag in tags:
+            for _ in range(rand.randint(0, max(1, size // 50))):
+                start = rand.randrange(size)
+                s = Range(start, min(size, start + rand.randint(1, 64)))
+                style[tag] = style[tag].union_without_merging(s) if tag in style else s
+        return style
+
+    def style_traits(text, style):
+        style_input = [set() for _ in range(len(text))]
+        for tag, s in style.items():
+            for s in s.args if s.is_Union else [s]:
+                for i in range(s.start, s.stop):
+                    style_input[i].add(tag)
+        return ['.'.join(sorted(s)) for s in style_input]
+
+    for n in (0, 1, 7, 100, 1000):
+        for _ in range(20):
+            node = XMLText('x' * n, start_idx=0)
+            node.__dict__['style'] = random_style(n) if n else {}
+            expected = style_traits(node.text, node.style)
+            assert node.style_traits == expected, 'style_traits differ'
+            assert [{*s.split('.')} if s else set() for s in expected] == node.style_input, 'style_input differ'
+            ids, traits = node.style_ids()
+            assert [traits[i] for i in ids] == expected, 'style_ids differ'
+            ids, traits = node.style_ids(numpy=True)
+            assert [traits[i] for i in ids.tolist()] == expected, 'numpy style_ids differ'
+            for _ in range(10):
+                start = rand.randint(0, n)
+                stop = rand.randint(start, n)
+                style = {}
+                for traits, s in node.style_over(start, stop).items():
+                    for s in s.args if s.is_Union else [s]:
+                        for i in s:
+                            style[i] = traits
+                assert style == {i: expected[i] for i in range(start, stop)}, 'style_over differs'
+
+    text = 'x' * size
+    style = random_style(size)
+    cost = [float('inf')] * 2
+    for _ in range(repeat):
+        start = time.perf_counter()
+        style_traits(text, style)
+        cost[0] = min(cost[0], time.perf_counter() - start)
+        node = XMLText(text, start_idx=0)
+        node.__dict__['style'] = style
+        start = time.perf_counter()
+        node.style_runs
+        cost[1] = min(cost[1], time.perf_counter() - start)
+    print(f'{size} characters in {len(node.style_runs)} style runs: per character in {cost[0]:.3f}s, as runs in {cost[1]:.4f}s, speedup {cost[0] / cost[1]:.0f}x')
+
+
+def test_offsets(spans=100000, repeat=3):
+    '''
+    check the offset arrays of random documents with sanity_check, check them against the per-node methods on documents without markup,
+    and print the time spent mapping spans one by one with getPhysicalIndices and at once with getPhysicalIndicesArray
+    '''
+    import time, random
+    import numpy as np
+    rand = random.Random(0)
+    for document, physicalIndices in (('a\tb', [0, 1, 1, 1, 1, 2, 3]), ('a\r\nb', [0, 1, 2, 3, 4]), ('x\n  y\n    z', [*range(12)])):
+        root = XMLParser().build(document)
+        root.sanity_check()
+        assert root.physicalIndices.tolist() == physicalIndices, f'{document!r}: {root.physicalIndices.tolist()}'
+
+    for document in ('<p>\tindented paragraph</p>', '<b>x</b>\n\n   \n\ty', '\t\ta\n\tb', 'a\r\n\r\n\tb'):
+        root = XMLParser().build(document)
+        root.sanity_check()
+        assert root.physicalIndices[-2] < len(document), f'{document!r}: {root.physicalIndices.tolist()}'
+
+    pieces = ['text', ' ', '\n', '\t', '\r\n', '\n  ', '\n\t', 'a b', '&nbsp;', '&lt;', '<b>', '</b>', '<i>bold</i>', '<br/>', "<font color='red'>", '</font>']
+    for _ in range(200):
+        document = ''.join(rand.choices(pieces, k=rand.randint(0, 30)))
+        root = XMLParser().build(document)
+        mismatches = root.sanity_check()
+        # the per-node methods count the spaces a tab was expanded into as physical characters
+        if '&' not in document and '<' not in document and '\t' not in document:
+            assert not mismatches, f'{document!r}: {mismatches}'
+            if text := root.text:
+                starts = np.array([rand.randrange(len(text)) for _ in range(20)])
+                stops = np.array([rand.randint(start + 1, len(text)) for start in starts.tolist()])
+                expected = np.array([root.getPhysicalIndices(start, stop) for start, stop in zip(starts.tolist(), stops.tolist())]).T
+                assert (np.array(root.getPhysicalIndicesArray(starts, stops)) == expected).all(), f'{document!r}: physical indices differ'
+
+    document = ''.join(rand.choices(['word', ' ', '&nbsp;', '\n'], k=20000))
+    root = XMLParser().build(document)
+    root.sanity_check()
+    text = root.text
+    starts = np.array([rand.randrange(len(text)) for _ in range(spans)])
+    stops = np.minimum(starts + np.array([rand.randint(1, 64) for _ in range(spans)]), len(text))
+    cost = [float('inf')] * 2
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i, j in zip(starts[:spans // 100].tolist(), stops[:spans // 100].tolist()):
+            root.getPhysicalIndices(i, j)
+        cost[0] = min(cost[0], (time.perf_counter() - start) * 100)
+        root.__dict__.pop('physicalIndices', None)
+        start = time.perf_counter()
+        root.getPhysicalIndicesArray(starts, stops)
+        cost[1] = min(cost[1], time.perf_counter() - start)
+    print(f'{spans} spans over {len(document)} characters: one by one in {cost[0]:.3f}s (extrapolated), as arrays in {cost[1]:.4f}s including the build of physicalIndices, speedup {cost[0] / cost[1]:.0f}x')
+
+
+def test_build(repeat=3):
+    '''
+    check that build yields the same trees as build_debug on random documents, malformed ones included, and print the time spent by each on markup-dense and prose-heavy documents
+    '''
+    import io, time, random, inspect, contextlib
+    rand = random.Random(0)
+
+    def signature(root):
+        return str(root), [(node.func, node.text if node.is_XMLText else None, node.start_idx if node.is_XMLText else None) for node in root.dfs()]
+
+    pieces = ['text', ' ', '\n', '  ', 'a b', '&nbsp;', '&lt;', '&#123;', '&amp', '&' + 'x' * 40 + ';', '<b>', '</b>', '<i>bold</i>', '<br/>', "<font color='red'>", '</font>',
+              '<a href="http://x.com/?q=1&r=2">', '</a>', '<mspace />', '<!-- c -->', '=', ';', "'", '"', 'é中', '<', '>', '/', '\t']
+    malformed = 0
+    for document in ['</&emsp;é中}a-ba-b%é中a:b(a b/><br>$}>&#x1F600;&amp'] + [''.join(rand.choices(pieces, k=rand.randint(0, 40))) for _ in range(1000)]:
+        # both builds print the errors of the characters they skip, which are counted rather than shown
+        errors = [io.StringIO(), io.StringIO()]
+        for output, build in zip(errors, ('build_debug', 'build')):
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                try:
+                    tree = signature(getattr(XMLParser(), build)(document))
+                except Exception as e:
+                    tree = repr(e)
+            if build == 'build_debug':
+                expected = tree
+        assert tree == expected, f'{document!r}: build differs from build_debug'
+        malformed += bool(errors[0].getvalue())
+    print(f'build agrees with build_debug on random documents, {malformed} of them malformed')
+
+    dense = inspect.getsource(test).split('"')[1] * 100
+    prose = "<p>Lorem ipsum dolor sit amet, <b>consectetur</b> adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.&nbsp;</p>\n" * 300
+    for name, document in (('markup-dense', dense), ('prose-heavy', prose)):
+        cost = {}
+        for build in ('build_debug', 'build'):
+            cost[build] = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                getattr(XMLParser(), build)(document)
+                cost[build] = min(cost[build], time.perf_counter() - start)
+        print(f'{name} {len(document)} characters: build_debug in {cost["build_debug"]:.3f}s, build in {cost["build"]:.3f}s, speedup {cost["build_debug"] / cost["build"]:.2f}x')
+
+
 if __name__ == '__main__':
-    test()
\ No newline at end of file
+    test()
@@ -10,6 +10,76 @@ def ascii2greek(x):
 
 from tqdm.utils import _text_width as strlen
 
+import functools
+
+# flags of char_table besides the width
+WHITESPACE = 4
+
+@functools.cache
+def char_table():
+    '''
+    numpy array mapping each codepoint to its width by strlen (1, or 2 if east asian wide or full width), plus WHITESPACE if it matches regex \\s
+    '''
+    import numpy as np
+    import regex as re
+    from unicodedata import east_asian_width
+    codepoints = ''.join(map(chr, range(0x110000)))
+    table = np.fromiter((2 if east_asian_width(ch) in 'FW' else 1 for ch in codepoints), np.uint8, len(codepoints))
+    for m in re.finditer(r'\s+', codepoints):
+        table[m.start():m.end()] |= WHITESPACE
+    return table
+
+def codepoints(text):
+    import numpy as np
+    return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), np.uint32)
+
+def utf8_offsets(text):
+    '''
+    prefix array of the utf-8 byte lengths of text: offsets[i] == len(text[:i].encode()), so that the byte length of text[start:stop] is offsets[stop] - offsets[start]
+    '''
+    import numpy as np
+    codes = codepoints(text)
+    offsets = np.zeros(len(codes) + 1, np.int64)
+    np.cumsum(1 + (codes >= 0x80) + (codes >= 0x800) + (codes >= 0x10000), out=offsets[1:])
+    return offsets
+
+def utf8_lengths(texts):
+    # the utf-8 byte lengths of texts, from the prefix array of their concatenation
+    import numpy as np
+    bounds = np.zeros(len(texts) + 1, np.int64)
+    np.cumsum([len(text) for text in texts], out=bounds[1:])
+    return np.diff(utf8_offsets(''.join(texts))[bounds]).tolist()
+
+def width_offsets(text):
+    '''
+    prefix arrays of text for the width by strlen of a slice of text with its whitespace runs collapsed into one space, as by re.sub(r'\\s+', ' ', ...):
+    width[i] is the width of the non-whitespace characters of text[:i], and runs[i] the number of whitespace runs starting in text[:i].
+    '''
+    import numpy as np
+    flags = char_table()[codepoints(text)]
+    space = (flags & WHITESPACE) != 0
+    width = np.zeros(len(flags) + 1, np.int64)
+    np.cumsum(np.where(space, 0, flags), out=width[1:])
+    starts = space.copy()
+    starts[1:] &= ~space[:-1]
+    runs = np.zeros(len(flags) + 1, np.int64)
+    np.cumsum(starts, out=runs[1:])
+    return width, runs, space
+
+def collapsed_widths(offsets, starts, stops):
+    '''
+    the widths by strlen of re.sub(r'\\s+', ' ', text[start:stop]) for the arrays of starts and stops, where offsets = width_offsets(text)
+    '''
+    import numpy as np
+    width, runs, space = offsets
+    starts = np.asarray(starts, np.int64)
+    stops = np.asarray(stops, np.int64)
+    widths = width[stops] - width[starts] + runs[stops] - runs[starts]
+    # a whitespace run across start is counted in text[start:stop] too
+    inner = (starts > 0) & (starts < stops)
+    inner[inner] = space[starts[inner]] & space[starts[inner] - 1]
+    return widths + inner
+
 
 if __name__ == '__main__':
     ...
\ No newline at end of file